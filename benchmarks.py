@@ -0,0 +1,169 @@
+"""
+Benchmark suite for the railway hot paths, with regression tracking.
+
+    python benchmarks.py run --sizes 100 10000 100000 --output results.json
+    python benchmarks.py compare baseline.json results.json --threshold 0.2
+
+run times each hot path on synthetic networks of the given sizes and saves the seconds per call as JSON,
+along with the time to import railway and utilities in a fresh interpreter (under the "import" size).
+compare lists every benchmark that got slower than the baseline by more than threshold (0.2 = 20%),
+and exits with status 1 if there are any, so it can fail a CI job.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from railway import fare_price, Station, RailNetwork
+from utilities import synthetic_stations, write_rail_network, read_rail_network
+
+SAMPLE = 1000 #stations/pairs cycled through by the per-call benchmarks
+IMPORTS = ('railway', 'utilities') #modules whose import time is tracked
+
+
+def per_call(func, calls:list, min_time:float=0.2, repeat:int=3, setup=None):
+    '''
+    Function times func over argument tuples in calls, cycling through them for at least min_time per repeat.
+    setup, if given, is called untimed before every pass over calls and returns the func to time, so a pass does not
+    reuse what the last one cached. Returns the best seconds per call over the repeats.
+    '''
+    best = float('inf')
+    for r in range(repeat):
+        n, elapsed = 0, 0.
+        while elapsed < min_time:
+            if setup is not None:
+                func = setup()
+            start = time.perf_counter()
+            for args in calls:
+                func(*args)
+            elapsed += time.perf_counter() - start
+            n += len(calls)
+        best = min(best, elapsed/n)
+    return best
+
+
+def fresh_network(stations:list):
+    '''
+    Function makes a network with its hub index built but no closest hubs worked out yet
+    '''
+    network = RailNetwork(stations)
+    network.hub_stations()
+    return network
+
+
+def bench_network(n_stations:int, n_regions:int, hub_fraction:float, seed:int=0, min_time:float=0.2):
+    '''
+    Function runs every benchmark on one synthetic network, returning seconds per call by benchmark name.
+    closest_hub is given copies of the stations, which the network never caches, and the journeys are timed on a fresh
+    network each pass, so the hub search is timed rather than the cached answers.
+    '''
+    stations = synthetic_stations(n_stations, n_regions, hub_fraction, seed)
+    network = RailNetwork(stations)
+    generator = random.Random(seed)
+    sample = [generator.choice(stations) for i in range(SAMPLE)]
+    strangers = [Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in sample] #not the network's own stations
+    pairs = [(generator.choice(stations).crs, generator.choice(stations).crs) for i in range(SAMPLE)]
+    regions = network.regions()
+
+    results = {
+        'distance_to': per_call(lambda a, b: a.distance_to(b), list(zip(sample, reversed(sample))), min_time),
+        'fare_price': per_call(fare_price, [(generator.uniform(0, 800), generator.randint(0, 1), generator.randint(1, 20)) for i in range(SAMPLE)], min_time),
+        'hub_stations': per_call(network.hub_stations, [(region,) for region in regions] + [('all',)], min_time),
+        'closest_hub': per_call(network.closest_hub, [(station,) for station in strangers], min_time),
+        'journey_planner': per_call(None, pairs, min_time, setup=lambda: fresh_network(stations).journey_planner),
+        'journey_fare': per_call(None, pairs, min_time, setup=lambda: fresh_network(stations).journey_fare),
+    }
+    results['compiled_journey_fare'] = per_call(network.compile().fare, pairs, min_time)
+    network.decompile()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder)/'stations.csv'
+        write_rail_network(stations, path)
+        results['read_rail_network'] = per_call(read_rail_network, [(path,)], min_time, repeat=1 if n_stations > 10000 else 3)
+    return results
+
+
+def import_time(module:str, repeat:int=5):
+    '''
+    Function times importing module in a fresh interpreter with python -X importtime, so interpreter start up is not counted.
+    Returns the best seconds over the repeats and the modules that import pulled in.
+    Bytecode is written on the first run so later runs time a normal, cached import.
+    '''
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONDONTWRITEBYTECODE'}
+    best, loaded = float('inf'), []
+    for r in range(repeat + 1):
+        done = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, env=env, check=True)
+        #lines are "import time: self [us] | cumulative | imported package", the top level import is reported last
+        lines = [line.split('|') for line in done.stderr.splitlines() if line.startswith('import time:') and '[us]' not in line]
+        if r:
+            best = min(best, int(lines[-1][1])/1e6)
+        loaded = [line[2].strip() for line in lines]
+    return best, loaded
+
+
+def run(sizes:list, n_regions:int=10, hub_fraction:float=0.05, seed:int=0, min_time:float=0.2):
+    '''
+    Function runs the benchmarks for each network size, returning the results with details of the run
+    '''
+    results = {}
+    for n_stations in sizes:
+        results[str(n_stations)] = bench_network(n_stations, min(n_regions, n_stations), hub_fraction, seed, min_time)
+    results['import'] = {module: import_time(module)[0] for module in IMPORTS}
+    return {'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'n_regions': n_regions, 'hub_fraction': hub_fraction, 'seed': seed},
+            'results': results}
+
+
+def compare(baseline:dict, current:dict, threshold:float=0.2):
+    '''
+    Function finds the benchmarks in both runs that are slower than the baseline by more than threshold.
+    Returns a list of (size, benchmark, baseline seconds, current seconds, ratio), slowest first.
+    '''
+    slower = []
+    for size, benches in current['results'].items():
+        for name, seconds in benches.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before and seconds/before > 1 + threshold:
+                slower.append((size, name, before, seconds, seconds/before))
+    return sorted(slower, key=lambda row: -row[4])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the railway hot paths')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000], help='number of stations in each network')
+    run_parser.add_argument('--regions', type=int, default=10, help='number of regions')
+    run_parser.add_argument('--hub-fraction', type=float, default=0.05, help='fraction of stations that are hubs')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent timing each benchmark per repeat')
+    run_parser.add_argument('--output', type=Path, default=Path('bench_results.json'))
+    compare_parser = commands.add_parser('compare', help='flag benchmarks slower than a baseline')
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('current', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.sizes, args.regions, args.hub_fraction, args.seed, args.min_time)
+        args.output.write_text(json.dumps(results, indent=2))
+        for size, benches in results['results'].items():
+            for name, seconds in benches.items():
+                print(f'{size:>8} {name:<18} {seconds*1e6:12.2f} us')
+        return 0
+
+    slower = compare(json.loads(args.baseline.read_text()), json.loads(args.current.read_text()), args.threshold)
+    for size, name, before, seconds, ratio in slower:
+        print(f'SLOWER {size:>8} {name:<18} {before*1e6:10.2f} us -> {seconds*1e6:10.2f} us ({ratio:.2f}x)')
+    print(f'{len(slower)} benchmark(s) slower than baseline by more than {args.threshold:.0%}')
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
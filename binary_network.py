@@ -0,0 +1,107 @@
+'''
+Binary network format, little-endian throughout:
+
+    magic (8 bytes) | header length (uint64) | JSON header | sections, each starting on a 64 byte boundary
+
+The JSON header holds the station count, region names, the optional source checksum and the offset, dtype and length
+of each section. Sections are the fixed width columns lat, lon (float64), region (uint16), hub (int8), the hub index
+(closest hub row per station as int32, -1 for regions without a hub) and the
+crs and name strings as utf-8 joined by NUL. The fixed width sections are memory-mapped on load, so processes reading
+the same file share one page-cached copy.
+'''
+
+import json
+import mmap
+import struct
+import numpy as np
+from railway import StationColumns
+from fare_engine import closest_hub_rows
+
+MAGIC = b'RAILNET1'
+VERSION = 1
+ALIGN = 64
+
+
+def _padding(offset:int):
+    return -offset % ALIGN
+
+
+def save_binary(network, path, checksum:str=None):
+    '''
+    Function writes a network to path in the binary format, checksum optionally records the source CSV
+    '''
+    columns = network.columns()
+    lat = np.asarray(columns.lat, dtype='<f8')
+    lon = np.asarray(columns.lon, dtype='<f8')
+    region = np.asarray(columns.region, dtype='<u2')
+    hub = np.asarray(columns.hub, dtype='<i1')
+    closest = columns.closest
+    if closest is None:
+        closest = closest_hub_rows(lat, lon, region.astype(np.intp), hub.astype(bool))
+    closest = np.asarray(closest, dtype='<i4')
+
+    sections = {'lat': lat.tobytes(), 'lon': lon.tobytes(), 'region': region.tobytes(), 'hub': hub.tobytes(),
+                'closest': closest.tobytes(),
+                'crs': '\0'.join(columns.crs).encode(), 'names': '\0'.join(columns.names).encode()}
+    dtypes = {'lat': '<f8', 'lon': '<f8', 'region': '<u2', 'hub': '<i1', 'closest': '<i4',
+              'crs': 'utf-8', 'names': 'utf-8'}
+
+    #offsets are relative to the end of the header, so the header can be sized after they are known
+    layout, offset = {}, 0
+    for name, data in sections.items():
+        layout[name] = [offset, dtypes[name], len(data)]
+        offset += len(data) + _padding(len(data))
+    header = json.dumps({'version': VERSION, 'n_stations': len(columns), 'region_names': columns.region_names,
+                         'checksum': checksum, 'sections': layout}).encode()
+    start = len(MAGIC) + 8 + len(header)
+    start += _padding(start)
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        file.write(b'\0'*(start - file.tell()))
+        for name, data in sections.items():
+            file.write(data + b'\0'*_padding(len(data)))
+
+
+def read_header(file):
+    '''
+    Function reads the JSON header of an open binary network file, and returns it with the offset the sections start at
+    '''
+    magic, length = struct.unpack('<8sQ', file.read(16))
+    if magic != MAGIC: raise(ValueError('File is not a binary rail network'))
+    header = json.loads(file.read(length))
+    if header['version'] != VERSION: raise(ValueError(f'Unsupported binary rail network version {header["version"]}'))
+    start = 16 + length
+    return header, start + _padding(start)
+
+
+def load_binary(path, network_class):
+    '''
+    Function loads a binary network file as a compact network_class, numeric columns are views of a read-only memory map
+    '''
+    with open(path, 'rb') as file:
+        header, start = read_header(file)
+        if header['n_stations'] == 0:
+            return network_class.from_columns(StationColumns())
+        memory = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) #stays open after the file is closed
+
+    def section(name):
+        offset, dtype, length = header['sections'][name]
+        if dtype == 'utf-8':
+            return memory[start + offset:start + offset + length].decode().split('\0')
+        return np.frombuffer(memory, dtype=dtype, count=length//np.dtype(dtype).itemsize, offset=start + offset)
+
+    columns = StationColumns.from_arrays(section('crs'), section('names'), header['region_names'], section('region'),
+                                         section('lat'), section('lon'), section('hub'), section('closest'))
+    return network_class.from_columns(columns)
+
+
+def read_checksum(path):
+    '''
+    Function returns the source checksum stored in a binary network file, None if it has none or is not a valid file
+    '''
+    try:
+        with open(path, 'rb') as file:
+            return read_header(file)[0]['checksum']
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
@@ -0,0 +1,123 @@
+'''
+Compiled fares: a network frozen into integer station ids and flat per-station lists, so pricing a journey is a few list
+lookups and one or two haversines, with no crs checks, journey planning, Station objects or hub index lookups per call.
+
+Every station id has its region id, latitude, longitude and the cosine of its latitude, the closest hub id (-1 if its region
+has no hub), the fares of the legs to and from that hub and the hub factor (1 + hubs in its region/10) of a leg between regions.
+The sums are done in the same order as RailNetwork.journey_fare, with the same floating point operations, so fares are
+identical to it (not only to the penny). When there are at most HUB_TABLE_MAX hubs the hub to hub leg fares are also
+tabled, so a journey between regions needs no trigonometry at all.
+'''
+import math
+from array import array
+from railway import fare_price
+
+R = 6371 #same earth radius as haversine
+HUB_TABLE_MAX = 2048 #most hubs the hub to hub fares are tabled for, H*H*8 bytes (32 MB at 2048)
+
+
+class CompiledFares:
+    '''
+    Frozen fare tables of a network. ids maps crs to station id, ids follow the order of the network's stations.
+    '''
+    def __init__(self, network):
+        columns = network.columns()
+        crs = list(columns.crs)
+        self.crs = crs
+        self.ids = {code: i for i, code in enumerate(crs)}
+        self.region = [int(region) for region in columns.region] #Python numbers, columns can be numpy arrays
+        self.lat = [float(lat) for lat in columns.lat]
+        self.lon = [float(lon) for lon in columns.lon]
+        self.cos_lat = [math.cos(lat*math.pi/180) for lat in self.lat] #as haversine works it out for each end
+
+        index = network._hub_index()
+        region_counts = [index.counts.get(name, 0) for name in columns.region_names]
+        self.hub_counts = [region_counts[region] for region in self.region] #hubs in each station's region
+        self.hub_factor = [1 + count/10 for count in self.hub_counts] #(1+(different_regions*hubs_in_dest_region)/10) with dr 1
+
+        self.closest = [-1]*len(crs)
+        self.to_hub = [0.]*len(crs)
+        self.from_hub = [0.]*len(crs)
+        for i in range(len(crs)):
+            if self.hub_counts[i]:
+                station = network.stations[crs[i]]
+                hub = network.closest_hub(station)
+                self.closest[i] = self.ids[hub.crs]
+                self.to_hub[i] = fare_price(station.distance_to(hub), 0, self.hub_counts[i])
+                self.from_hub[i] = fare_price(hub.distance_to(station), 0, self.hub_counts[i])
+
+        self.hubs = sorted(set(h for h in self.closest if h >= 0)) #only hubs some station is closest to can be on a journey
+        hub_slot = {h: slot for slot, h in enumerate(self.hubs)}
+        self.hub_col = [hub_slot.get(h, -1) for h in self.closest] #closest hub's row and column of hub_fares
+        self.hub_row = [slot*len(self.hubs) for slot in self.hub_col]
+        self.hub_fares = None
+        if len(self.hubs) <= HUB_TABLE_MAX:
+            self.hub_fares = array('d', (fare_price(self.distance(a, b), 1, self.hub_counts[b]) for a in self.hubs for b in self.hubs))
+        self.fare_ids, self.fare = self._pricer()
+
+    def __len__(self):
+        return len(self.crs)
+
+    def distance(self, i:int, j:int):
+        '''
+        Function returns the distance in km between two station ids, the same as Station.distance_to
+        '''
+        lat_dif = (self.lat[j] - self.lat[i])*0.5
+        lon_dif = (self.lon[j] - self.lon[i])*0.5
+        k_1 = math.sqrt((math.sin(lat_dif*math.pi/180))**2 + ((self.cos_lat[i]*self.cos_lat[j])*(math.sin(lon_dif*math.pi/180))**2))
+        return abs(2*R*math.asin(k_1))
+
+    def _pricer(self):
+        '''
+        Function makes the fare function of the tables, which holds every list it uses as a local of a closure
+        so a call does no attribute lookups. Returns fare_ids(i, j), the fare from station id i to station id j, and
+        fare(start, dest) of two crs, both raising KeyError for an unknown crs or id or a region with no hub.
+        '''
+        ids, region, closest, to_hub, from_hub = self.ids, self.region, self.closest, self.to_hub, self.from_hub
+        lat, lon, cos_lat, hub_factor = self.lat, self.lon, self.cos_lat, self.hub_factor
+        hub_fares, hub_row, hub_col, distance_ids = self.hub_fares, self.hub_row, self.hub_col, self.distance
+        sin, sqrt, asin, exp, pi = math.sin, math.sqrt, math.asin, math.exp, math.pi
+        diameter = 2*R
+
+        def fare_ids(i:int, j:int):
+            si = closest[i]
+            sj = closest[j]
+            if si < 0 or sj < 0: raise KeyError('Region not in network or has no hubs')
+            if region[i] == region[j]: #haversine and fare_price with different_regions 0, operations in the same order
+                k_1 = sqrt((sin((lat[j] - lat[i])*0.5*pi/180))**2 + ((cos_lat[i]*cos_lat[j])*(sin((lon[j] - lon[i])*0.5*pi/180))**2))
+                distance = abs(diameter*asin(k_1))
+                return 1 + distance*exp(-distance/100)
+
+            if hub_fares is None:
+                distance = distance_ids(si, sj)
+                hub_leg = 1 + distance*exp(-distance/100)*hub_factor[j]
+            else:
+                hub_leg = hub_fares[hub_row[i] + hub_col[j]]
+            if si == i and sj == j: #2 legs straight from hub to hub
+                return hub_leg
+            fare = to_hub[i]
+            if si == i or sj == j:
+                fare += -1 #3 legs, see journey_fare
+            fare += hub_leg
+            fare += from_hub[j]
+            return fare
+
+        def fare(start:str, dest:str):
+            return fare_ids(ids[start], ids[dest])
+
+        return fare_ids, fare
+
+    def fares(self, pairs):
+        '''
+        Function returns the fares of an iterable of (start, dest) crs as a list, nan where a region has no hub
+        '''
+        ids, fare_ids = self.ids, self.fare_ids
+        fares = []
+        for start, dest in pairs:
+            try:
+                fares.append(fare_ids(ids[start], ids[dest]))
+            except KeyError:
+                if start not in ids or dest not in ids:
+                    raise
+                fares.append(math.nan)
+        return fares
@@ -0,0 +1,252 @@
+import math
+from array import array
+import numpy as np
+
+R = 6371 #same earth radius as Station.distance_to
+BLOCK_ROWS = 256 #rows of the fare matrix computed at once, keeps the temporary arrays small
+
+
+def haversine(lat_1, lon_1, lat_2, lon_2):
+    '''
+    Vectorised version of Station.distance_to, inputs are arrays of degrees that broadcast together.
+    The operations are done in the same order as distance_to so results agree to the last few bits.
+    '''
+    lat_dif = (lat_2 - lat_1)*0.5
+    lon_dif = (lon_2 - lon_1)*0.5
+
+    k_1 = np.sqrt((np.sin(lat_dif*math.pi/180))**2 +
+                  ((np.cos(lat_1*math.pi/180)*np.cos(lat_2*math.pi/180))*(np.sin(lon_dif*math.pi/180))**2))
+
+    return np.abs(2*R*np.arcsin(k_1))
+
+
+def fare_prices(distance, different_regions, hubs_in_dest_region):
+    '''
+    Vectorised version of fare_price, inputs are arrays (or scalars) that broadcast together
+    '''
+    return 1 + distance*np.exp(-distance/100)*(1+(different_regions*hubs_in_dest_region)/10)
+
+
+def column_array(values, dtype):
+    '''
+    Function gives a StationColumns column as a numpy array. Typed arrays are copied, as a view would stop them growing,
+    numpy columns (e.g. memory-mapped) are used as they are.
+    '''
+    if isinstance(values, array):
+        return np.array(values, dtype=dtype)
+    return np.asarray(values, dtype=dtype)
+
+
+def closest_hub_rows(lat, lon, region, hub, block_rows=4096, regions=None):
+    '''
+    Function finds the row of the closest hub in the same region for every station, -1 if the region has no hub.
+    Ties go to the hub added last, the same as RailNetwork.closest_hub. regions optionally limits the search to some region ids,
+    the other stations are left at -1.
+    '''
+    closest = np.full(len(lat), -1, dtype=np.intp)
+
+    for r in np.unique(region[hub]) if regions is None else np.intersect1d(region[hub], regions):
+        hubs = np.flatnonzero(hub & (region == r)) #ascending rows is insertion order
+        members = np.flatnonzero(region == r)
+
+        for first in range(0, len(members), block_rows): #blocks keep the members x hubs array bounded
+            rows = members[first:first + block_rows]
+            distance = haversine(lat[hubs][None, :], lon[hubs][None, :], lat[rows][:, None], lon[rows][:, None])
+            last_min = distance.shape[1] - 1 - np.argmin(distance[:, ::-1], axis=1) #argmin of reversed gives last tie
+            closest[rows] = hubs[last_min]
+
+    return closest
+
+
+class FareTables:
+    '''
+    Per-station arrays every fare is built from: region, closest hub, hub counts and the fares of the legs to and from the closest hub.
+    columns is a StationColumns, closest optionally gives precomputed closest hub rows.
+    '''
+    ARRAYS = ('lat', 'lon', 'region', 'closest', 'hub_counts', 'hubs_in_region', 'has_hub', 'hub_self', 'to_hub', 'from_hub')
+
+    def __init__(self, columns, closest=None):
+        self.columns = columns
+        self._sorted_crs = None
+        self.lat = column_array(columns.lat, np.float64)
+        self.lon = column_array(columns.lon, np.float64)
+        self.region = np.asarray(columns.region, dtype=np.intp)
+        hub = np.asarray(columns.hub, dtype=bool)
+
+        self.hub_counts = np.bincount(self.region[hub], minlength=len(columns.region_names))
+        if closest is None:
+            closest = closest_hub_rows(self.lat, self.lon, self.region, hub)
+        self.closest = np.array(closest, dtype=np.intp)
+        self.hubs_in_region = self.hub_counts[self.region]
+        self.has_hub = self.hubs_in_region > 0
+        self.hub_self = np.zeros(len(self.lat), dtype=bool)
+        self.to_hub = np.empty(len(self.lat))
+        self.from_hub = np.empty(len(self.lat))
+        self._legs(slice(None))
+
+    def _legs(self, rows):
+        '''
+        Function works out the closest hub parts of the tables for some rows, from their closest hub rows and hub counts
+        '''
+        self.closest[rows] = np.where(self.has_hub[rows], self.closest[rows], 0) #any valid row, fares touching these stations are masked to nan
+        self.hub_self[rows] = self.closest[rows] == np.arange(len(self.lat))[rows] #station is its own closest hub
+
+        #first and last leg of a journey between regions, station to closest hub and closest hub to station
+        lat, lon, sh = self.lat[rows], self.lon[rows], self.closest[rows]
+        self.to_hub[rows] = fare_prices(haversine(lat, lon, self.lat[sh], self.lon[sh]), 0, self.hubs_in_region[rows])
+        self.from_hub[rows] = fare_prices(haversine(self.lat[sh], self.lon[sh], lat, lon), 0, self.hubs_in_region[rows])
+
+    def update(self, regions):
+        '''
+        Function brings the tables up to date after stations of the columns were changed in place (no rows added or removed),
+        only working out the closest hubs again for the stations of the given region names
+        '''
+        columns = self.columns
+        self.lat = column_array(columns.lat, np.float64)
+        self.lon = column_array(columns.lon, np.float64)
+        self.region = np.asarray(columns.region, dtype=np.intp)
+        hub = np.asarray(columns.hub, dtype=bool)
+        self.hub_counts = np.bincount(self.region[hub], minlength=len(columns.region_names))
+
+        ids = [columns.region_id(region) for region in regions]
+        rows = np.flatnonzero(np.isin(self.region, ids))
+        self.closest[rows] = closest_hub_rows(self.lat, self.lon, self.region, hub, regions=ids)[rows]
+        self.hubs_in_region = self.hub_counts[self.region]
+        self.has_hub = self.hubs_in_region > 0
+        self._legs(rows)
+
+    @classmethod
+    def from_arrays(cls, arrays:dict):
+        '''
+        Function makes tables around existing arrays (one for each name in ARRAYS), e.g. views of shared memory.
+        Tables made this way have no columns, so can only work with rows and not crs.
+        '''
+        tables = cls.__new__(cls)
+        tables.columns = None
+        tables._sorted_crs = None
+        for name in cls.ARRAYS:
+            setattr(tables, name, arrays[name])
+        return tables
+
+    def arrays(self):
+        '''
+        Function returns the arrays from_arrays needs, by name
+        '''
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def rows(self, codes):
+        '''
+        Function converts an array (any shape) of crs codes to station rows, with a sorted search instead of a dict lookup per code
+        '''
+        codes = np.asarray(codes, dtype=str)
+        if codes.size == 0: #no codes, or an empty network asked for none
+            return np.zeros(codes.shape, dtype=np.intp)
+        if len(self) == 0:
+            raise(KeyError(f'crs not in network: {codes.ravel()[0]}'))
+        if self._sorted_crs is None:
+            self._order = np.argsort(np.array(self.columns.crs))
+            self._sorted_crs = np.array(self.columns.crs)[self._order]
+        found = np.minimum(np.searchsorted(self._sorted_crs, codes), len(self) - 1)
+        missing = self._sorted_crs[found] != codes
+        if missing.any():
+            raise(KeyError(f'crs not in network: {codes[missing][0]}'))
+        return self._order[found]
+
+    def hub_distance(self, start_hubs, end_hubs):
+        '''
+        Function gives the distance in km of the middle leg of journeys between regions, from arrays of their closest hub rows
+        '''
+        return haversine(self.lat[start_hubs], self.lon[start_hubs], self.lat[end_hubs], self.lon[end_hubs])
+
+    def legs(self, start, dest):
+        '''
+        Function gives the number of stations journey_planner puts on each journey: 2 inside a region,
+        otherwise 2 plus one for each end that is not its own closest hub
+        '''
+        between = self.region[start] != self.region[dest]
+        return 2 + between*(~self.hub_self[start]) + between*(~self.hub_self[dest])
+
+    def fares(self, start, dest):
+        '''
+        Function calculates the fares between arrays of start and dest rows, which broadcast together.
+        Journeys are grouped by their shape (2, 3 or 4 legs) and each group is priced with only the legs it has, using the same
+        leg by leg sums as RailNetwork.journey_fare so fares agree to the penny.
+        '''
+        start, dest = np.broadcast_arrays(np.asarray(start, dtype=np.intp), np.asarray(dest, dtype=np.intp))
+        shape = start.shape
+        start, dest = start.ravel(), dest.ravel()
+        lat, lon = self.lat, self.lon
+        legs = self.legs(start, dest)
+        fares = np.empty(len(start), dtype=np.float64)
+
+        #2 legs, straight from start to dest: either inside one region or between two hubs
+        group = np.flatnonzero(legs == 2)
+        s, d = start[group], dest[group]
+        distance = haversine(lat[s], lon[s], lat[d], lon[d])
+        different_regions = self.region[s] != self.region[d]
+        fares[group] = fare_prices(distance, different_regions, self.hubs_in_region[d])
+
+        #3 and 4 legs: start -> closest hub -> closest hub -> dest, a 3 leg journey has a zero length leg worth 1 to take off
+        for n_legs in (3, 4):
+            group = np.flatnonzero(legs == n_legs)
+            s, d = start[group], dest[group]
+            sh, eh = self.closest[s], self.closest[d]
+            hub_leg = fare_prices(self.hub_distance(sh, eh), 1, self.hubs_in_region[d])
+            fares[group] = self.to_hub[s] - (n_legs == 3) + hub_leg + self.from_hub[d]
+
+        fares[~(self.has_hub[start] & self.has_hub[dest])] = np.nan
+        return fares.reshape(shape)
+
+    def routes(self, start, dest):
+        '''
+        Function gives the rows of the stations on each journey as journey_planner plans them, one row per journey
+        padded with -1 to 4 stations. Journeys touching a region with no hub are all -1.
+        '''
+        start, dest = np.asarray(start, dtype=np.intp).ravel(), np.asarray(dest, dtype=np.intp).ravel()
+        between = self.region[start] != self.region[dest]
+        route = np.full((len(start), 4), -1, dtype=np.intp)
+        route[:, 0] = start
+        route[:, 1] = np.where(between & ~self.hub_self[start], self.closest[start], -1)
+        route[:, 2] = np.where(between & ~self.hub_self[dest], self.closest[dest], -1)
+        route[:, 3] = dest
+        route[~(self.has_hub[start] & self.has_hub[dest])] = -1
+        return route
+
+    def matrix(self, rows=None, cols=None, block_rows=BLOCK_ROWS):
+        '''
+        Function returns the fare matrix for the given start rows and dest columns (default all), computed in blocks of rows
+        '''
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.intp)
+        cols = np.arange(len(self)) if cols is None else np.asarray(cols, dtype=np.intp)
+
+        out = np.empty((len(rows), len(cols)), dtype=np.float64)
+        for first in range(0, len(rows), block_rows):
+            block = rows[first:first + block_rows]
+            out[first:first + len(block)] = self.fares(block[:, None], cols[None, :])
+        return out
+
+
+def journey_fares(tables, pairs, routes=False, workers=1):
+    '''
+    Function prices (start, dest) crs pairs with a FareTables, see RailNetwork.journey_fares
+    '''
+    codes = np.asarray(pairs if isinstance(pairs, np.ndarray) else list(pairs), dtype=str)
+    if codes.size == 0:
+        codes = codes.reshape(0, 2)
+    if codes.ndim != 2 or codes.shape[1] != 2: raise(ValueError('pairs must be (start, dest) crs pairs'))
+
+    rows = tables.rows(codes)
+    if workers == 1:
+        fares = tables.fares(rows[:, 0], rows[:, 1])
+    else:
+        from parallel_fares import parallel_fares
+        fares = parallel_fares(tables, rows[:, 0], rows[:, 1], workers)
+    if not routes:
+        return fares
+
+    crs = np.array(list(tables.columns.crs) + [None], dtype=object) #row -1 picks the None
+    planned = [[code for code in route if code is not None] or None for route in crs[tables.routes(rows[:, 0], rows[:, 1])].tolist()]
+    return fares, planned
@@ -0,0 +1,126 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from parallel_fares import share_arrays, view_arrays, check_workers
+
+FORMATS = ('png', 'svg')
+_worker = {} #state of a pool worker: the shared fare matrix and the figure it reuses
+
+
+def report_name(name:str, crs:str, fmt:str):
+    '''
+    Function gives the file name of the histogram of fares to a station, like plot_fares_to but with the crs so names are unique
+    '''
+    station_name = re.sub(r'[^\w\-]', '_', name.replace(" ", "_")) #no path separators or other odd characters
+    return f'Fare_prices_to_{station_name}_{crs}.{fmt}'
+
+
+def _figure():
+    '''
+    Function makes the one figure a process draws every histogram on. It is drawn by an Agg canvas of its own,
+    without pyplot, so the backend and figures of the caller's pyplot are left alone.
+    '''
+    if 'figure' not in _worker:
+        figure = Figure(figsize=(6.4, 4.8))
+        FigureCanvasAgg(figure)
+        _worker['figure'], _worker['axes'] = figure, figure.add_subplot()
+    return _worker['figure'], _worker['axes']
+
+
+def render_histogram(fares, station_name:str, path, hist_args:dict):
+    '''
+    Function draws the histogram of the fares to one station on the reused figure and saves it to path
+    '''
+    figure, axes = _figure()
+    axes.cla()
+    axes.set_title(f"Fare prices to {station_name.replace(' ', '_')}")
+    axes.set_xlabel("Fare price (Pound)")
+    axes.hist(fares, **hist_args)
+    figure.savefig(path)
+
+
+def _render_columns(first:int, last:int):
+    '''
+    Function renders the histograms for destination columns first to last of the shared fare matrix
+    '''
+    fares = _worker['fares']
+    names, crs, out_dir, fmt, hist_args = _worker['job']
+    for col in range(first, last):
+        column = np.delete(fares[:, col], col) #fares from every other station
+        render_histogram(column[~np.isnan(column)], names[col], out_dir/report_name(names[col], crs[col], fmt), hist_args)
+    return last - first
+
+
+def _attach(memory_name:str, layout:dict, job:tuple):
+    memory = SharedMemory(memory_name)
+    _worker['memory'] = memory #kept so the view stays valid
+    _worker['fares'] = view_arrays(memory, layout)['fares']
+    _worker['job'] = job
+
+
+def render_fare_reports(network, out_dir, fmt:str='png', workers:int=1, fares=None, crs=None, **hist_args):
+    '''
+    Function renders a histogram of the fares to every station in the network, without any window or key press,
+    and saves them to out_dir as png or svg files named by report_name. Returns the number of files written.
+    The fares come from a precomputed fare matrix and its crs order (as given by fare_matrix) or are computed here,
+    destinations are split over a process pool of workers (None for one per CPU), each reusing a single figure.
+    **hist_args are used for the hist plot, as in plot_fares_to
+    '''
+    if fmt not in FORMATS: raise(ValueError(f'fmt must be one of {", ".join(FORMATS)}'))
+    workers = check_workers(workers)
+    if fares is None:
+        fares, crs = network.fare_matrix(workers=workers)
+    elif crs is None or len(crs) != len(fares):
+        raise(ValueError('crs must give the order of the fare matrix'))
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    names = [network.stations[code].name for code in crs]
+    job = (names, list(crs), out_dir, fmt, hist_args)
+
+    memory, layout = share_arrays({'fares': np.asarray(fares, dtype=np.float64)})
+    try:
+        if workers == 1:
+            _attach(memory.name, layout, job)
+            try:
+                return _render_columns(0, len(crs))
+            finally:
+                _worker.pop('fares')
+                _worker.pop('memory').close()
+        bounds = np.linspace(0, len(crs), min(workers*4, max(len(crs), 1)) + 1).astype(int)
+        with ProcessPoolExecutor(workers, initializer=_attach, initargs=(memory.name, layout, job)) as pool:
+            return sum(pool.map(_render_columns, bounds[:-1], bounds[1:]))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def render_journeys(network, pairs, out_dir, fmt:str='png'):
+    '''
+    Function draws the journey for each (start, dest) crs pair over the network, as plot_journey does, and saves them to out_dir
+    named Journey_{start}_{dest}.{fmt}. The network is scattered once and only the journey line is redrawn for each pair.
+    Returns the paths written.
+    '''
+    if fmt not in FORMATS: raise(ValueError(f'fmt must be one of {", ".join(FORMATS)}'))
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    figure, axes = _figure()
+    axes.cla()
+    axes.scatter([s.lon for s in network.stations.values()], [s.lat for s in network.stations.values()], s=1, c="blue", marker="x")
+    axes.set_xlabel("Longitude (degrees)")
+    axes.set_ylabel("Latitude (degrees)")
+
+    paths = []
+    for start, dest in pairs:
+        journey = network.journey_planner(start, dest)
+        line, = axes.plot([s.lon for s in journey], [s.lat for s in journey], "ro-", markersize=2)
+        axes.set_title(f"Journey from {journey[0].name} to {journey[-1].name}")
+        paths.append(out_dir/f'Journey_{start}_{dest}.{fmt}')
+        figure.savefig(paths[-1])
+        line.remove()
+    return paths
@@ -0,0 +1,314 @@
+'''
+Versioned fare table snapshots and diffs between them, little-endian throughout:
+
+    magic (8 bytes) | sections, each starting on a 64 byte boundary | JSON footer | footer length (uint64) | magic
+
+The footer holds the label, station count, region names and the offset, dtype and length of each section, as in
+binary_network, and the blake2b hash of each chunk of chunk_rows rows of the fare table. The footer comes last so the fares
+can be written a chunk at a time. Sections are the crs (utf-8 joined by NUL), what each station's fares depend on: region
+(uint16), lat and lon (float64), closest hub row (int32, -1 for regions without a hub) and hubs in its region (int32), and
+the N x N fare table in pence (int32, -1 where there is no fare), which is memory-mapped on load.
+
+    python fare_snapshot.py save stations.csv fares-v2.snap --label v2
+    python fare_snapshot.py load fares-v2.snap
+    python fare_snapshot.py diff fares-v1.snap fares-v2.snap --csv changes.csv
+
+A fare only depends on those per-station values of its two ends (and of their closest hubs), so a diff works out which stations
+changed from the station sections alone and only compares the fare rows of changed start stations and the fare columns of changed
+dest stations, skipping any chunk whose hash is the same in both. A network can be diffed against a snapshot the same way,
+working out only the rows and columns of its changed stations instead of the whole table.
+'''
+import argparse
+import hashlib
+import json
+import struct
+import sys
+from pathlib import Path
+import numpy as np
+
+MAGIC = b'RAILFARE'
+VERSION = 1
+ALIGN = 64
+CHUNK_ROWS = 256
+NO_FARE = -1 #pence stored for a journey with no fare
+
+
+def _padding(offset:int):
+    return -offset % ALIGN
+
+
+def to_pence(fares):
+    '''
+    Function rounds fares in pounds to whole pence as int32, NO_FARE where a fare is nan
+    '''
+    pence = np.round(np.asarray(fares)*100)
+    return np.where(np.isnan(pence), NO_FARE, pence).astype('<i4')
+
+
+def to_pounds(pence):
+    '''
+    Function turns stored pence back into fares in pounds, nan where there is no fare
+    '''
+    pence = np.asarray(pence)
+    return np.where(pence == NO_FARE, np.nan, pence/100)
+
+
+def chunk_hash(data:bytes):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def station_table(tables):
+    '''
+    Function returns the per-station values fares depend on from a FareTables, by section name
+    '''
+    return {'crs': list(tables.columns.crs), 'region_names': list(tables.columns.region_names),
+            'region': np.asarray(tables.region, dtype='<u2'), 'lat': np.asarray(tables.lat, dtype='<f8'),
+            'lon': np.asarray(tables.lon, dtype='<f8'), 'closest': np.where(tables.has_hub, tables.closest, -1).astype('<i4'),
+            'hubs_in_region': np.asarray(tables.hubs_in_region, dtype='<i4')}
+
+
+def write_snapshot(tables, path, label:str=None, chunk_rows:int=CHUNK_ROWS):
+    '''
+    Function writes the fare table of a FareTables to path, working it out chunk_rows rows at a time.
+    Returns the number of chunks written.
+    '''
+    if not isinstance(chunk_rows, int) or chunk_rows < 1: raise(ValueError('chunk_rows must be a positive int'))
+    stations = station_table(tables)
+    n = len(tables)
+    layout, chunks = {}, []
+    with open(path, 'wb') as file:
+        file.write(MAGIC + b'\0'*_padding(len(MAGIC)))
+        for name in ('region', 'lat', 'lon', 'closest', 'hubs_in_region', 'crs'):
+            data = '\0'.join(stations[name]).encode() if name == 'crs' else stations[name].tobytes()
+            layout[name] = [file.tell(), 'utf-8' if name == 'crs' else stations[name].dtype.str, len(data)]
+            file.write(data + b'\0'*_padding(len(data)))
+
+        layout['fares'] = [file.tell(), '<i4', n*n*4]
+        for first in range(0, n, chunk_rows):
+            rows = np.arange(first, min(first + chunk_rows, n))
+            data = to_pence(tables.matrix(rows)).tobytes()
+            chunks.append(chunk_hash(data))
+            file.write(data)
+        file.write(b'\0'*_padding(file.tell()))
+
+        footer = json.dumps({'version': VERSION, 'label': label, 'n_stations': n, 'region_names': stations['region_names'],
+                             'unit': 'pence', 'chunk_rows': chunk_rows, 'chunks': chunks, 'sections': layout}).encode()
+        file.write(footer + struct.pack('<Q', len(footer)) + MAGIC)
+    return len(chunks)
+
+
+class FareSnapshot:
+    '''
+    A snapshot written by write_snapshot, with its stations read into memory and its fare table in pence memory-mapped
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC: raise(ValueError('File is not a fare snapshot'))
+            file.seek(-8 - len(MAGIC), 2)
+            length, magic = struct.unpack('<Q8s', file.read(8 + len(MAGIC)))
+            if magic != MAGIC: raise(ValueError('Fare snapshot is incomplete'))
+            file.seek(-8 - len(MAGIC) - length, 2)
+            self.header = json.loads(file.read(length))
+            if self.header['version'] != VERSION: raise(ValueError(f'Unsupported fare snapshot version {self.header["version"]}'))
+
+            self.stations = {'region_names': self.header['region_names']}
+            for name, (offset, dtype, length) in self.header['sections'].items():
+                if name == 'fares':
+                    continue
+                file.seek(offset)
+                data = file.read(length)
+                self.stations[name] = data.decode().split('\0') if dtype == 'utf-8' else np.frombuffer(data, dtype=dtype)
+        n = self.header['n_stations']
+        if n == 0:
+            self.stations['crs'] = []
+        offset = self.header['sections']['fares'][0]
+        self.fares = np.memmap(path, dtype='<i4', mode='r', offset=offset, shape=(n, n)) if n else np.empty((0, 0), dtype='<i4')
+        self.index = {crs: row for row, crs in enumerate(self.stations['crs'])}
+
+    @property
+    def label(self):
+        return self.header['label']
+
+    @property
+    def crs(self):
+        return self.stations['crs']
+
+    def __len__(self):
+        return self.header['n_stations']
+
+    def fare(self, start:str, dest:str):
+        '''
+        Function returns the stored fare of a journey in pounds, nan if it has no fare
+        '''
+        return float(to_pounds(self.fares[self.index[start], self.index[dest]]))
+
+    def chunk_range(self, chunk:int):
+        '''
+        Function returns the slice of fare table rows a chunk holds
+        '''
+        rows = self.header['chunk_rows']
+        return slice(chunk*rows, min((chunk + 1)*rows, len(self)))
+
+    def verify(self):
+        '''
+        Function checks every chunk of the fare table against its hash, returning the chunks that do not match
+        '''
+        return [chunk for chunk, expected in enumerate(self.header['chunks'])
+                if chunk_hash(np.ascontiguousarray(self.fares[self.chunk_range(chunk)]).tobytes()) != expected]
+
+    def block(self, rows, cols):
+        '''
+        Function returns the stored pence for rows x cols
+        '''
+        return self.fares[np.asarray(rows, dtype=np.intp)[:, None], np.asarray(cols, dtype=np.intp)[None, :]]
+
+
+class NetworkFares:
+    '''
+    The fares of a FareTables looked at like a FareSnapshot, worked out only for the rows and columns asked for
+    '''
+    header = {'chunks': None}
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.stations = station_table(tables)
+
+    @property
+    def crs(self):
+        return self.stations['crs']
+
+    def block(self, rows, cols):
+        return to_pence(self.tables.matrix(rows, cols))
+
+
+def signatures(stations:dict, rows):
+    '''
+    Function gives, for the stations at rows, the values their fares from anywhere depend on (region name, position,
+    closest hub crs and position, -1 row for none) and the hubs in their region, which fares to them also depend on
+    '''
+    rows = np.asarray(rows, dtype=np.intp)
+    closest = stations['closest'][rows]
+    hub = np.maximum(closest, 0) #stations without a hub are told apart by the closest crs being None
+    start = list(zip(np.array(stations['region_names'] or [''], dtype=object)[stations['region'][rows]].tolist(),
+                     stations['lat'][rows].tolist(), stations['lon'][rows].tolist(),
+                     [stations['crs'][h] if c >= 0 else None for h, c in zip(hub.tolist(), closest.tolist())],
+                     stations['lat'][hub].tolist(), stations['lon'][hub].tolist()))
+    return start, stations['hubs_in_region'][rows].tolist()
+
+
+def diff(old, new, full:bool=False, block_rows:int=CHUNK_ROWS):
+    '''
+    Function compares the fares of two FareSnapshot (or NetworkFares for new), see the module docstring.
+    Only fares between stations in both are compared, and only those starting or ending at a changed station unless full.
+    Chunks whose hashes match are skipped when both are snapshots of the same stations in the same order.
+    Returns a dict of the added, removed and changed stations, counts of the pairs compared and chunks skipped,
+    and the origin, dest, old and new fares (pounds, nan for no fare) of every pair whose fare changed.
+    '''
+    old_index = {crs: row for row, crs in enumerate(old.crs)}
+    new_index = {crs: row for row, crs in enumerate(new.crs)}
+    common = [crs for crs in new.crs if crs in old_index]
+    old_rows = np.array([old_index[crs] for crs in common], dtype=np.intp)
+    new_rows = np.array([new_index[crs] for crs in common], dtype=np.intp)
+
+    old_start, old_count = signatures(old.stations, old_rows)
+    new_start, new_count = signatures(new.stations, new_rows)
+    start_changed = np.array([a != b for a, b in zip(old_start, new_start)], dtype=bool)
+    dest_changed = start_changed | (np.array(old_count, dtype=np.intp) != np.array(new_count, dtype=np.intp))
+    if full:
+        start_changed[:] = True
+
+    #rows of chunks whose hashes match hold the same fares, so are left out of the comparison
+    same_rows = np.zeros(len(common), dtype=bool)
+    skipped = 0
+    if old.header['chunks'] is not None and new.header['chunks'] is not None and list(old.crs) == list(new.crs) \
+       and old.header['chunk_rows'] == new.header['chunk_rows']:
+        for chunk, (a, b) in enumerate(zip(old.header['chunks'], new.header['chunks'])):
+            if a == b:
+                same_rows[old.chunk_range(chunk)] = True
+                skipped += 1
+
+    found = {'origin': [], 'dest': [], 'old': [], 'new': []}
+    compared = 0
+    def compare(rows, cols): #rows and cols index common
+        nonlocal compared
+        if len(rows) == 0 or len(cols) == 0:
+            return
+        before, after = old.block(old_rows[rows], old_rows[cols]), new.block(new_rows[rows], new_rows[cols])
+        compared += before.size
+        r, c = np.nonzero(before != after)
+        for name, values in zip(found, (np.array(common)[rows[r]], np.array(common)[cols[c]], before[r, c], after[r, c])):
+            found[name].append(values)
+
+    everyone = np.arange(len(common))
+    starts = np.flatnonzero(start_changed & ~same_rows)
+    for first in range(0, len(starts), block_rows):
+        compare(starts[first:first + block_rows], everyone)
+    others = np.flatnonzero(~start_changed & ~same_rows)
+    dests = np.flatnonzero(dest_changed)
+    for first in range(0, len(others), block_rows):
+        compare(others[first:first + block_rows], dests)
+
+    changes = {name: np.concatenate(values) if values else np.empty(0, dtype=str if name in ('origin', 'dest') else '<i4')
+               for name, values in found.items()}
+    changes['old'], changes['new'] = to_pounds(changes['old']), to_pounds(changes['new'])
+    return {'added': [crs for crs in new.crs if crs not in old_index], 'removed': [crs for crs in old.crs if crs not in new_index],
+            'changed': [crs for crs, changed in zip(common, dest_changed) if changed], 'pairs_compared': compared,
+            'chunks_skipped': skipped, 'fares': changes}
+
+
+def write_changes(changes:dict, path):
+    '''
+    Function writes the changed fares of a diff to a CSV file with an origin,dest,old,new header, empty where there is no fare
+    '''
+    import csv
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['origin', 'dest', 'old', 'new'])
+        fares = changes['fares']
+        for row in zip(fares['origin'].tolist(), fares['dest'].tolist(), fares['old'].tolist(), fares['new'].tolist()):
+            writer.writerow([value if value == value else '' for value in row])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fare table snapshots and diffs between them')
+    commands = parser.add_subparsers(dest='command', required=True)
+    save = commands.add_parser('save', help='snapshot the fares of a stations CSV')
+    save.add_argument('stations', type=Path, help='CSV of the stations, as read by read_rail_network')
+    save.add_argument('snapshot', type=Path)
+    save.add_argument('--label', help='version label stored in the snapshot')
+    save.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    load = commands.add_parser('load', help='open a snapshot, check every chunk against its hash and summarise it')
+    load.add_argument('snapshot', type=Path)
+    compare = commands.add_parser('diff', help='list the fares that changed between two snapshots')
+    compare.add_argument('old', type=Path)
+    compare.add_argument('new', type=Path)
+    compare.add_argument('--csv', type=Path, help='file to write the changed fares to')
+    compare.add_argument('--full', action='store_true', help='compare every fare, not only those of changed stations')
+    args = parser.parse_args(argv)
+
+    if args.command == 'save':
+        from utilities import read_rail_network
+        network = read_rail_network(args.stations, use_cache=True)
+        chunks = network.save_fare_snapshot(args.snapshot, args.label, args.chunk_rows)
+        print(f'Wrote {network.n_stations} stations in {chunks} chunks to {args.snapshot}')
+        return 0
+
+    if args.command == 'load':
+        snapshot = FareSnapshot(args.snapshot)
+        corrupted = snapshot.verify()
+        print(json.dumps({'label': snapshot.label, 'stations': len(snapshot), 'chunks': len(snapshot.header['chunks']),
+                          'corrupted': corrupted}))
+        return 1 if corrupted else 0
+
+    changes = diff(FareSnapshot(args.old), FareSnapshot(args.new), args.full)
+    if args.csv:
+        write_changes(changes, args.csv)
+    summary = {name: changes[name] for name in ('added', 'removed', 'changed', 'pairs_compared', 'chunks_skipped')}
+    summary['fares_changed'] = len(changes['fares']['old'])
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
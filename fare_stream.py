@@ -0,0 +1,105 @@
+'''
+Streaming fares for every journey to, from or between all stations, a chunk of stations at a time so memory stays bounded.
+Chunks are (origin crs, dest crs, fare) numpy columns, fares are nan where a region has no hub and a station's fare to itself is left out.
+They can be written straight to a CSV file or to columnar .npy files (origin.npy, dest.npy, fare.npy) that np.load can memory-map.
+'''
+import csv
+from pathlib import Path
+import numpy as np
+from numpy.lib.format import open_memmap
+
+CHUNK_SIZE = 4096 #stations per chunk for the fares to or from one station
+ALL_CHUNK_SIZE = 64 #start stations per chunk of all fares, each gives a chunk of N-1 fares per station
+
+
+def _crs(tables):
+    return np.array(tables.columns.crs)
+
+
+def fares_to_chunks(tables, dest:str, chunk_size:int=CHUNK_SIZE):
+    '''
+    Function yields the fares from every other station to dest in chunks of up to chunk_size stations
+    '''
+    crs, d = _crs(tables), tables.rows([dest])[0]
+    for first in range(0, len(crs), chunk_size):
+        rows = np.arange(first, min(first + chunk_size, len(crs)))
+        rows = rows[rows != d]
+        yield crs[rows], np.full(len(rows), dest), tables.fares(rows, d)
+
+
+def fares_from_chunks(tables, start:str, chunk_size:int=CHUNK_SIZE):
+    '''
+    Function yields the fares from start to every other station in chunks of up to chunk_size stations
+    '''
+    crs, s = _crs(tables), tables.rows([start])[0]
+    for first in range(0, len(crs), chunk_size):
+        cols = np.arange(first, min(first + chunk_size, len(crs)))
+        cols = cols[cols != s]
+        yield np.full(len(cols), start), crs[cols], tables.fares(s, cols)
+
+
+def all_fares_chunks(tables, chunk_size:int=ALL_CHUNK_SIZE):
+    '''
+    Function yields the fares of every journey, for chunk_size start stations at a time in the order of the network
+    '''
+    crs = _crs(tables)
+    n = len(crs)
+    for first in range(0, n, chunk_size):
+        rows = np.arange(first, min(first + chunk_size, n))
+        keep = (rows[:, None] != np.arange(n)[None, :]).ravel()
+        fares = tables.matrix(rows).ravel()[keep]
+        yield np.repeat(crs[rows], n)[keep], np.tile(crs, len(rows))[keep], fares
+
+
+def check_chunk_size(chunk_size:int):
+    if not isinstance(chunk_size, int) or chunk_size < 1: raise(ValueError('chunk_size must be a positive int'))
+
+
+def as_tuples(chunks):
+    '''
+    Function turns chunks into (origin, dest, fare) tuples one at a time
+    '''
+    for origins, dests, fares in chunks:
+        yield from zip(origins.tolist(), dests.tolist(), fares.tolist())
+
+
+def write_csv(chunks, path):
+    '''
+    Function writes chunks to a CSV file with an origin,dest,fare header, empty fares where there is none.
+    Returns the number of fares written.
+    '''
+    written = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['origin', 'dest', 'fare'])
+        for origins, dests, fares in chunks:
+            writer.writerows(zip(origins.tolist(), dests.tolist(), ['' if fare != fare else fare for fare in fares.tolist()]))
+            written += len(fares)
+    return written
+
+
+def write_columns(chunks, directory, n_fares:int):
+    '''
+    Function writes chunks holding n_fares fares in all to origin.npy, dest.npy and fare.npy in directory,
+    filling memory-mapped files so only one chunk is in memory at a time. Returns the number of fares written.
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    dtypes = {'origin': '<U3', 'dest': '<U3', 'fare': np.float64} #crs are always 3 characters
+    if n_fares == 0: #an empty file cannot be memory-mapped
+        for name, dtype in dtypes.items():
+            np.save(directory/f'{name}.npy', np.empty(0, dtype=dtype))
+        return 0
+    columns = [open_memmap(directory/f'{name}.npy', mode='w+', dtype=dtype, shape=(n_fares,)) for name, dtype in dtypes.items()]
+
+    written = 0
+    for chunk in chunks:
+        n = len(chunk[2])
+        if written + n > n_fares: raise(ValueError('more fares than n_fares'))
+        for column, values in zip(columns, chunk):
+            column[written:written + n] = values
+        written += n
+    for column in columns:
+        column.flush()
+    if written != n_fares: raise(ValueError(f'{written} fares were written, expected {n_fares}'))
+    return written
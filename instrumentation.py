@@ -0,0 +1,205 @@
+"""
+Opt-in timing of the RailNetwork methods and Station.distance_to.
+
+    import instrumentation
+    with instrumentation.profile() as prof:
+        network.journey_fare('BRI', 'MAN')
+    print(prof.prometheus())
+
+While enabled the methods in METHODS are replaced on their classes by timing wrappers, and the originals are put back
+when disabled, so there is no cost at all when instrumentation is off. Times are inclusive, e.g. journey_fare includes
+the closest_hub calls it makes. Cache hit rates are counted for closest_hub (the hub index) and for journey_planner
+and journey_fare (the cache of enable_cache).
+"""
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from railway import RailNetwork, Station, FareCache
+
+METHODS = {Station: ('distance_to',),
+           RailNetwork: ('regions', 'hub_stations', 'closest_hub', 'journey_planner', 'journey_fare', '_price_journey',
+                         'fare_matrix', 'journey_fares', 'route', 'nearest', 'within_radius')}
+QUANTILES = (0.5, 0.9, 0.99)
+CACHE_KINDS = {'journey': 'journey_planner', 'fare': 'journey_fare'} #FareCache key kind to the method it caches for
+
+
+class MethodStats:
+    '''
+    Call count, total time and the most recent window call times of one method, with its cache hits and misses
+    '''
+    def __init__(self, window:int):
+        self.calls = 0
+        self.seconds = 0.
+        self.times = deque(maxlen=window)
+        self.hits = 0
+        self.misses = 0
+
+    def quantile(self, q:float):
+        '''
+        Function returns the q (0 to 1) quantile of the recent call times in seconds, nearest rank
+        '''
+        ordered = sorted(self.times)
+        return ordered[max(math.ceil(q*len(ordered)) - 1, 0)] if ordered else 0.
+
+
+class Profile:
+    '''
+    Statistics recorded by the instrumentation wrappers, by method name
+    '''
+    def __init__(self, window:int=10000):
+        if not isinstance(window, int) or window < 1: raise(ValueError('window must be a positive int'))
+        self.window = window
+        self.methods = {}
+
+    def method(self, name:str):
+        if name not in self.methods:
+            self.methods[name] = MethodStats(self.window)
+        return self.methods[name]
+
+    def record(self, name:str, seconds:float):
+        stats = self.method(name)
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.times.append(seconds)
+
+    def cache(self, name:str, hit:bool):
+        stats = self.method(name)
+        if hit:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+
+    def stats(self):
+        '''
+        Function returns the statistics as a dict of method name to calls, times in seconds and cache hit rate
+        '''
+        out = {}
+        for name, stats in sorted(self.methods.items()):
+            lookups = stats.hits + stats.misses
+            out[name] = {'calls': stats.calls, 'total_s': stats.seconds, 'mean_s': stats.seconds/stats.calls if stats.calls else 0.,
+                         **{f'p{round(q*100)}_s': stats.quantile(q) for q in QUANTILES},
+                         'cache_hits': stats.hits, 'cache_misses': stats.misses, 'hit_rate': stats.hits/lookups if lookups else None}
+        return out
+
+    def prometheus(self, prefix:str='railway'):
+        '''
+        Function returns the statistics in the Prometheus text exposition format
+        '''
+        lines = [f'# HELP {prefix}_call_seconds Time per call of each method.', f'# TYPE {prefix}_call_seconds summary']
+        for name, stats in sorted(self.methods.items()):
+            if stats.calls:
+                for q in QUANTILES:
+                    lines.append(f'{prefix}_call_seconds{{method="{name}",quantile="{q}"}} {stats.quantile(q):.9g}')
+                lines.append(f'{prefix}_call_seconds_sum{{method="{name}"}} {stats.seconds:.9g}')
+                lines.append(f'{prefix}_call_seconds_count{{method="{name}"}} {stats.calls}')
+        for kind in ('hits', 'misses'):
+            lines += [f'# HELP {prefix}_cache_{kind}_total Cache {kind} of each method.', f'# TYPE {prefix}_cache_{kind}_total counter']
+            for name, stats in sorted(self.methods.items()):
+                if stats.hits + stats.misses:
+                    lines.append(f'{prefix}_cache_{kind}_total{{method="{name}"}} {getattr(stats, kind)}')
+        return '\n'.join(lines) + '\n'
+
+
+_active = None #Profile being recorded to, None when disabled
+_originals = {} #(class, name) to the method the wrapper replaced
+
+
+def _timed(name:str, method):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if _active is not None: #a wrapper bound before disable can still be called
+                _active.record(name, time.perf_counter() - start)
+    wrapper.__wrapped__ = method
+    wrapper.__name__, wrapper.__doc__ = method.__name__, method.__doc__
+    return wrapper
+
+
+def _timed_closest_hub(method):
+    timed = _timed('closest_hub', method)
+    def wrapper(self, s):
+        if _active is not None: #hits are the lookups closest_hub answers without measuring, as it decides them
+            index = self._index
+            hit = self._owns(s) and ((index is not None and s.crs in index.closest.get(s.region, ()))
+                                     or (self.compact and self._columns.closest is not None))
+            _active.cache('closest_hub', hit)
+        return timed(self, s)
+    wrapper.__wrapped__ = method
+    wrapper.__name__, wrapper.__doc__ = method.__name__, method.__doc__
+    return wrapper
+
+
+def _counted_get(method):
+    def wrapper(self, key):
+        value = method(self, key)
+        if _active is not None and isinstance(key, tuple) and key[0] in CACHE_KINDS:
+            _active.cache(CACHE_KINDS[key[0]], value is not None)
+        return value
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def enable(profile:Profile=None):
+    '''
+    Function starts recording to profile (a new Profile if not given) and returns it, replacing any profile being recorded
+    '''
+    global _active
+    _active = Profile() if profile is None else profile
+    if not _originals:
+        for cls, names in METHODS.items():
+            for name in names:
+                _originals[(cls, name)] = cls.__dict__[name]
+                wrap = _timed_closest_hub if name == 'closest_hub' else lambda method, name=name: _timed(name, method)
+                setattr(cls, name, wrap(cls.__dict__[name]))
+        _originals[(FareCache, 'get')] = FareCache.__dict__['get']
+        FareCache.get = _counted_get(FareCache.__dict__['get'])
+    return _active
+
+
+def disable():
+    '''
+    Function stops recording and puts the original methods back, returning the profile that was recorded
+    '''
+    global _active
+    for (cls, name), method in _originals.items():
+        setattr(cls, name, method)
+    _originals.clear()
+    profile, _active = _active, None
+    return profile
+
+
+def enabled():
+    return _active is not None
+
+
+def stats():
+    '''
+    Function returns the statistics of the profile being recorded, see Profile.stats
+    '''
+    return _active.stats() if _active is not None else {}
+
+
+def prometheus(prefix:str='railway'):
+    '''
+    Function returns the profile being recorded as Prometheus text, see Profile.prometheus
+    '''
+    return _active.prometheus(prefix) if _active is not None else ''
+
+
+@contextmanager
+def profile(window:int=10000):
+    '''
+    Context manager recording a new Profile for the block it wraps, any profile being recorded before resumes afterwards
+    '''
+    previous = _active
+    recording = enable(Profile(window))
+    try:
+        yield recording
+    finally:
+        if previous is None:
+            disable()
+        else:
+            enable(previous)
@@ -0,0 +1,106 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from fare_engine import FareTables
+
+_worker = {} #state of a pool worker: its shared memory handles and the array views of them
+
+
+def share_arrays(arrays:dict, outputs:dict={}):
+    '''
+    Function copies named arrays into one shared memory block, and makes room in it for outputs given as name: (shape, dtype).
+    Returns the block and the layout to view it with.
+    '''
+    layout, size = {}, 0
+    shapes = {name: (array.shape, array.dtype) for name, array in arrays.items()}
+    shapes.update(outputs)
+    for name, (shape, dtype) in shapes.items():
+        dtype = np.dtype(dtype)
+        layout[name] = (size, dtype.str, shape)
+        size += -(-int(np.prod(shape))*dtype.itemsize//64)*64 #keep every array 64 byte aligned
+    memory = SharedMemory(create=True, size=max(size, 1))
+    views = view_arrays(memory, layout)
+    for name, array in arrays.items():
+        views[name][...] = array
+    return memory, layout
+
+
+def view_arrays(memory, layout:dict):
+    '''
+    Function views the arrays in a shared memory block made by share_arrays
+    '''
+    return {name: np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset) for name, (offset, dtype, shape) in layout.items()}
+
+
+def _attach(tables_name:str, tables_layout:dict, work_name:str, work_layout:dict):
+    '''
+    Function runs once in each pool worker, viewing the shared tables and work arrays instead of receiving copies
+    '''
+    tables_memory, work_memory = SharedMemory(tables_name), SharedMemory(work_name)
+    _worker['memory'] = (tables_memory, work_memory) #kept so the views stay valid
+    _worker['tables'] = FareTables.from_arrays(view_arrays(tables_memory, tables_layout))
+    _worker['work'] = view_arrays(work_memory, work_layout)
+
+
+def _matrix_columns(first:int, last:int):
+    '''
+    Function fills the destination columns first to last of the shared fare matrix
+    '''
+    work = _worker['work']
+    work['fares'][:, first:last] = _worker['tables'].matrix(cols=np.arange(first, last))
+
+
+def _pair_slice(first:int, last:int):
+    '''
+    Function prices the pairs first to last of the shared start/dest rows
+    '''
+    work = _worker['work']
+    work['fares'][first:last] = _worker['tables'].fares(work['start'][first:last], work['dest'][first:last])
+
+
+def _run(tables:FareTables, inputs:dict, output_shape:tuple, task, n_items:int, workers:int):
+    '''
+    Function shares the tables and input arrays, splits range(n_items) into contiguous slices and runs task on them in a
+    process pool, the tasks write to a shared float64 fares array of output_shape. Returns a copy of it once every slice is done.
+    '''
+    tables_memory, tables_layout = share_arrays(tables.arrays())
+    work_memory, work_layout = share_arrays(inputs, {'fares': (output_shape, np.float64)})
+    try:
+        bounds = np.linspace(0, n_items, min(workers*4, max(n_items, 1)) + 1).astype(int) #a few slices per worker to balance load
+        with ProcessPoolExecutor(workers, initializer=_attach,
+                                 initargs=(tables_memory.name, tables_layout, work_memory.name, work_layout)) as pool:
+            for done in pool.map(task, bounds[:-1], bounds[1:]):
+                pass
+        return view_arrays(work_memory, work_layout)['fares'].copy()
+    finally:
+        for memory in (tables_memory, work_memory):
+            memory.close()
+            memory.unlink()
+
+
+def check_workers(workers):
+    '''
+    Function checks a worker count, None means one per CPU
+    '''
+    if workers is None:
+        return os.cpu_count() or 1
+    if not isinstance(workers, int) or workers < 1: raise(ValueError('workers must be a positive int'))
+    return workers
+
+
+def parallel_matrix(tables:FareTables, workers=None):
+    '''
+    Function computes the full fare matrix with a process pool, each task fills a slice of destination columns.
+    Every fare is worked out with the same operations as FareTables.matrix, so the result is identical.
+    '''
+    n = len(tables)
+    return _run(tables, {}, (n, n), _matrix_columns, n, check_workers(workers))
+
+
+def parallel_fares(tables:FareTables, start, dest, workers=None):
+    '''
+    Function prices arrays of start and dest rows with a process pool, each task prices a contiguous slice of the pairs
+    '''
+    start, dest = np.asarray(start, dtype=np.intp), np.asarray(dest, dtype=np.intp)
+    return _run(tables, {'start': start, 'dest': dest}, (len(start),), _pair_slice, len(start), check_workers(workers))
@@ -0,0 +1,115 @@
+"""
+Plotting for RailNetwork, kept out of railway so matplotlib is only imported the first time something is plotted.
+The RailNetwork plot methods call these functions.
+"""
+import matplotlib.pyplot as plt
+
+
+def interactive_backend():
+    '''
+    Function checks whether matplotlib is using a backend that opens windows, rather than a headless one such as Agg
+    '''
+    from matplotlib.backends import backend_registry, BackendFilter
+    return plt.get_backend().lower() in backend_registry.list_builtin(BackendFilter.INTERACTIVE)
+
+
+def plot_fares_to(network, crs_code:str, save:bool, **args):
+    """
+    Function to plot all fares to one specific station. 
+    Takes crs_code of station as input and produces histogram of fare prices from all other stations
+    save is true for image to be saved locally to computer
+    **args are used for the hist plot
+    """
+    if not isinstance(save, bool): raise TypeError('save must be bool')
+
+    fares = []
+    for station in network.stations.values(): 
+        if crs_code != station.crs: #ensure not checking self
+            if [station.region in network.hub_stations().keys()]: #ensure station can be travelled to
+                fares.append(network.journey_fare(station.crs, crs_code))
+
+    station_name = network.stations[crs_code].name.replace(" ", "_")
+    plt.title(f"Fare prices to {station_name}")
+    plt.xlabel("Fare price (Pound)")
+
+    if args != None: 
+       fig = plt.hist(fares, **args)
+    else:
+       fig = plt.hist(fares)
+
+    if save:
+       fig = plt.savefig(f"./Fare_prices_to_{station_name}.png")
+
+    if interactive_backend(): #nothing to press under a headless backend such as Agg, see fare_reports for batch use
+        plt.waitforbuttonpress(0)
+
+
+    return fig
+
+
+def plot_network(network, marker_size: int = 5) -> None:
+    """
+    A function to plot the rail network, for visualisation purposes.
+    You can optionally pass a marker size (in pixels) for the plot to use.
+
+    The method will produce a matplotlib figure showing the locations of the stations in the network, and
+    attempt to use matplotlib.pyplot.show to display the figure.
+
+    This function will not execute successfully until you have created the regions() function.
+    You are NOT required to write tests nor documentation for this function.
+    """
+    fig, ax = plt.subplots(figsize=(5, 10))
+    ax.set_xlabel("Longitude (degrees)")
+    ax.set_ylabel("Latitude (degrees)")
+    ax.set_title("Railway Network")
+
+    COLOURS = ["b", "r", "g", "c", "m", "y", "k"]
+    MARKERS = [".", "o", "x", "*", "+"]
+
+    for i, r in enumerate(network.regions()):
+        lats = [s.lat for s in network.stations.values() if s.region == r]
+        lons = [s.lon for s in network.stations.values() if s.region == r]
+
+        colour = COLOURS[i % len(COLOURS)]
+        marker = MARKERS[i % len(MARKERS)]
+        ax.scatter(lons, lats, s=marker_size, c=colour, marker=marker, label=r)
+
+    ax.legend()
+    plt.tight_layout()
+    plt.show()
+    return
+
+
+def plot_journey(network, start: str, dest: str) -> None:
+    """
+    Plot the journey between the start and end stations, on top of the rail network map.
+    The start and dest inputs should the strings corresponding to the CRS codes of the
+    starting and destination stations, respectively.
+
+    The method will overlay the route that your journey_planner method has found on the
+    locations of the stations in your network, and draw lines to indicate the route.
+
+    This function will not successfully execute until you have written the journey_planner method.
+    You are NOT required to write tests nor documentation for this function.
+    """
+    # Plot railway network in the background
+    network_lats = [s.lat for s in network.stations.values()]
+    network_lons = [s.lon for s in network.stations.values()]
+
+    fig, ax = plt.subplots(figsize=(5, 10))
+    ax.scatter(network_lons, network_lats, s=1, c="blue", marker="x")
+    ax.set_xlabel("Longitude (degrees)")
+    ax.set_ylabel("Latitude (degrees)")
+
+    # Compute the journey
+    journey = network.journey_planner(start, dest)
+    plot_title = f"Journey from {journey[0].name} to {journey[-1].name}"
+    ax.set_title(f"Journey from {journey[0].name} to {journey[-1].name}")
+
+    # Draw over the network with the journey
+    journey_lats = [s.lat for s in journey]
+    journey_lons = [s.lon for s in journey]
+    ax.plot(journey_lons, journey_lats, "ro-", markersize=2)
+
+    plt.show()
+    return
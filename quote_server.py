@@ -0,0 +1,296 @@
+"""
+Asyncio fare quote service for a RailNetwork, using only the standard library (and numpy through journey_fares).
+
+    python quote_server.py stations.csv --port 8080
+
+    GET  /fare?start=BRI&dest=MAN      {"start": "BRI", "dest": "MAN", "fare": 12.34}
+    GET  /journey?start=BRI&dest=MAN   the same with "route", the crs of the stations on the journey
+    POST /fares {"pairs": [["BRI", "MAN"], ...]}   {"fares": [12.34, null, ...]}, null where there is no fare
+    GET  /metrics                      request counts, batch sizes and p50/p99 latency in ms
+
+Quotes for a (start, dest) already being priced wait for that result instead of pricing it again. Quotes arriving
+within batch_delay of each other are priced together in one vectorised journey_fares call, and batches of at least
+executor_batch pairs are priced in an executor so the event loop keeps serving.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class LatencyStats:
+    '''
+    Latencies of the most recent window requests of each kind, with their percentiles
+    '''
+    def __init__(self, window:int=10000):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+
+    def add(self, kind:str, seconds:float):
+        self.samples.setdefault(kind, deque(maxlen=self.window)).append(seconds)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def percentile(self, kind:str, q:float):
+        '''
+        Function returns the q (0 to 100) percentile latency in seconds of a kind of request, nearest rank
+        '''
+        ordered = sorted(self.samples.get(kind, ()))
+        if not ordered:
+            return None
+        return ordered[max(math.ceil(q/100*len(ordered)) - 1, 0)]
+
+    def summary(self):
+        '''
+        Function returns the count, p50 and p99 in ms for each kind of request
+        '''
+        return {kind: {'count': self.counts[kind], 'p50_ms': self.percentile(kind, 50)*1e3,
+                       'p99_ms': self.percentile(kind, 99)*1e3} for kind in self.samples}
+
+
+class FareQuoter:
+    '''
+    Prices journeys for many concurrent callers. Duplicate (start, dest) quotes in flight share one result and
+    concurrent quotes are micro-batched into one journey_fares call, so fares agree with journey_fare to the penny.
+    Must be used from inside a running event loop.
+    '''
+    def __init__(self, network, batch_delay:float=0.002, max_batch:int=4096, executor_batch:int=256, executor=None):
+        if batch_delay < 0: raise(ValueError('batch_delay must not be negative'))
+        if not isinstance(max_batch, int) or max_batch < 1: raise(ValueError('max_batch must be a positive int'))
+        self.network = network
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.executor_batch = executor_batch
+        self.executor = executor #None uses the event loop's default executor
+        self.in_flight = {} #(start, dest) to the future of its fare
+        self.pending = [] #pairs waiting for the next batch
+        self._flush = None
+        self._tasks = set() #batches being priced, held here as the event loop only keeps weak references to tasks
+        self.latency = LatencyStats()
+        self.counts = {'quotes': 0, 'coalesced': 0, 'batches': 0, 'executor_batches': 0, 'priced': 0}
+        network.journey_fares([]) #builds the fare tables now, so executor threads never build them at the same time
+
+    async def fare(self, start:str, dest:str):
+        '''
+        Function returns the fare of a journey, raising KeyError for an unknown crs or a region with no hub
+        '''
+        began = time.perf_counter()
+        self.counts['quotes'] += 1
+        key = (start, dest)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            self.pending.append(key)
+            if len(self.pending) >= self.max_batch:
+                self._start_batch()
+            elif self._flush is None:
+                self._flush = asyncio.get_running_loop().call_later(self.batch_delay, self._start_batch)
+        else:
+            self.counts['coalesced'] += 1
+        try:
+            return await asyncio.shield(future) #one caller cancelling must not cancel the others
+        finally:
+            self.latency.add('fare', time.perf_counter() - began)
+
+    async def fares(self, pairs:list):
+        '''
+        Function returns the fares of many journeys, None where a journey has no fare
+        '''
+        async def fare_or_none(start, dest):
+            try:
+                return await self.fare(start, dest)
+            except KeyError:
+                return None
+        return await asyncio.gather(*(fare_or_none(start, dest) for start, dest in pairs))
+
+    async def journey(self, start:str, dest:str):
+        '''
+        Function returns the crs of the stations on a journey and its fare
+        '''
+        began = time.perf_counter()
+        try:
+            route = [station.crs for station in self.network.journey_planner(start, dest)]
+            return route, await self.fare(start, dest)
+        finally:
+            self.latency.add('journey', time.perf_counter() - began)
+
+    def _start_batch(self):
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._price(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _price(self, batch:list):
+        '''
+        Function prices a batch of pairs and settles their futures, in an executor when the batch is large
+        '''
+        self.counts['batches'] += 1
+        self.counts['priced'] += len(batch)
+        stations = self.network.stations
+        known = [pair for pair in batch if pair[0] in stations and pair[1] in stations]
+        try:
+            if len(known) >= self.executor_batch:
+                self.counts['executor_batches'] += 1
+                fares = await asyncio.get_running_loop().run_in_executor(self.executor, self.network.journey_fares, known)
+            else:
+                fares = self.network.journey_fares(known) if known else []
+            results = dict(zip(known, fares.tolist() if known else []))
+            for pair in batch:
+                fare = results.get(pair)
+                if pair not in results:
+                    error = KeyError(f'crs not in network: {pair[0] if pair[0] not in stations else pair[1]}')
+                elif math.isnan(fare):
+                    error = KeyError('Region not in network or has no hubs')
+                else:
+                    error = None
+                self._settle(pair, fare, error)
+        except Exception as error:
+            for pair in batch:
+                self._settle(pair, None, error)
+
+    def _settle(self, pair:tuple, fare, error):
+        future = self.in_flight.pop(pair)
+        if future.done():
+            return
+        if error is None:
+            future.set_result(fare)
+        else:
+            future.set_exception(error)
+
+    def metrics(self):
+        '''
+        Function returns the counters and latency percentiles as a dict
+        '''
+        return {**self.counts, 'latency': self.latency.summary()}
+
+
+class QuoteServer:
+    '''
+    Minimal HTTP/1.1 server for a FareQuoter, see the module docstring for the endpoints
+    '''
+    def __init__(self, quoter:FareQuoter):
+        self.quoter = quoter
+        self.server = None
+
+    async def start(self, host:str='127.0.0.1', port:int=8080):
+        '''
+        Function starts listening and returns the (host, port) bound, port 0 picks a free port
+        '''
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        '''
+        Function serves the requests of one connection until the client closes it
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method, target = request_line.decode('latin-1').split()[:2]
+                began = time.perf_counter()
+                status, reply = await self.respond(method, target, body)
+                self.quoter.latency.add('http', time.perf_counter() - began)
+
+                data = json.dumps(reply).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: application/json\r\n'
+                             f'Content-Length: {len(data)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method:str, target:str, body:bytes):
+        '''
+        Function returns the status and JSON reply for one request
+        '''
+        url = urlsplit(target)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/metrics':
+                return 200, self.quoter.metrics()
+            if url.path in ('/fare', '/journey'):
+                if method != 'GET': return 405, {'error': 'use GET'}
+                if 'start' not in query or 'dest' not in query: return 400, {'error': 'start and dest are needed'}
+                start, dest = query['start'], query['dest']
+                if url.path == '/fare':
+                    return 200, {'start': start, 'dest': dest, 'fare': await self.quoter.fare(start, dest)}
+                route, fare = await self.quoter.journey(start, dest)
+                return 200, {'start': start, 'dest': dest, 'route': route, 'fare': fare}
+            if url.path == '/fares':
+                if method != 'POST': return 405, {'error': 'use POST'}
+                payload = json.loads(body or b'{}')
+                if not isinstance(payload, dict): return 400, {'error': 'body must be a JSON object'}
+                pairs = payload.get('pairs')
+                if not isinstance(pairs, list) or not all(isinstance(pair, list) and len(pair) == 2 for pair in pairs):
+                    return 400, {'error': 'pairs must be a list of [start, dest]'}
+                return 200, {'fares': await self.quoter.fares([tuple(pair) for pair in pairs])}
+            return 404, {'error': f'no endpoint {url.path}'}
+        except KeyError as error:
+            return 404, {'error': error.args[0] if error.args else str(error)}
+        except (ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error: #anything else still gets a reply, rather than the connection being dropped
+            return 500, {'error': f'internal error: {type(error).__name__}'}
+
+
+async def serve(network, host:str='127.0.0.1', port:int=8080, **quoter_args):
+    '''
+    Function serves fare quotes for a network until cancelled
+    '''
+    server = QuoteServer(FareQuoter(network, **quoter_args))
+    host, port = await server.start(host, port)
+    print(f'Serving fare quotes on http://{host}:{port}')
+    async with server.server:
+        await server.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fare quote server for a rail network CSV')
+    parser.add_argument('stations', type=Path, help='CSV of the stations, as read by read_rail_network')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--batch-delay', type=float, default=0.002, help='seconds to wait for more quotes to batch')
+    parser.add_argument('--executor-batch', type=int, default=256, help='batches this large are priced off the event loop')
+    args = parser.parse_args(argv)
+
+    from utilities import read_rail_network
+    network = read_rail_network(args.stations, use_cache=True)
+    try:
+        asyncio.run(serve(network, args.host, args.port, batch_delay=args.batch_delay, executor_batch=args.executor_batch))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    main()
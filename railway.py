@@ -1,5 +1,8 @@
-import matplotlib.pyplot as plt
 import math 
+import bisect
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
 
 
 def fare_price(distance:float, different_regions:int, hubs_in_dest_region:int):
@@ -12,7 +15,81 @@ def fare_price(distance:float, different_regions:int, hubs_in_dest_region:int):
     return fare_price
 
 
+def haversine(lat_1:float, lon_1:float, lat_2:float, lon_2:float):
+    '''
+    Function calculates the great circle distance in km between two points given in degrees
+    '''
+    #splitting equation for easier readability and error checking
+    lat_dif = (lat_2 - lat_1)*0.5
+    lon_dif = (lon_2 - lon_1)*0.5
+
+    #multiplying by pi/180 to convert from radian to degrees
+    k_1 = math.sqrt((math.sin(lat_dif*math.pi/180))**2 + 
+                    ((math.cos(lat_1*math.pi/180)*math.cos(lat_2*math.pi/180))*(math.sin(lon_dif*math.pi/180))**2))
+    
+    R = 6371 #declaring R as constant in case earth explodes and loses width
+    return abs(2*R*math.asin(k_1)) #abs to prevent negative distances
+
+
+def plan_journey(start_station, dest_station, start_hub, end_hub):
+    '''
+    Function lists the stations of a journey given its ends and their closest hubs, see RailNetwork.journey_planner
+    '''
+    journey = []
+    journey.append(start_station) #start is always included
+
+    #append if journey is inbetween regions
+    #compared by crs since a compact network makes a new Station for every lookup
+    if start_hub.crs != start_station.crs and start_hub.region != end_hub.region:
+        journey.append(start_hub)
+
+    if end_hub.crs != dest_station.crs and end_hub.region != start_hub.region:
+        journey.append(end_hub)
+
+    journey.append(dest_station) #end is included due to 'clerical error in assignment'
+    return journey
+
+
+def price_journey(journey:list, closest_hub, hub_counts:dict, distance_between):
+    '''
+    Function works out the fare of a journey planned by plan_journey leg by leg.
+    closest_hub gives the closest hub of a station, hub_counts the number of hubs in each region and distance_between the km between two stations.
+    '''
+    journey_fare = 0 #if 1 leg, then no cost
+    start_station = journey[0]
+    dest_station = journey[-1]
+    hubs_in_dest_region = hub_counts[dest_station.region]
+
+    if len(journey) == 2: # for simple 2 leg case
+        distance = distance_between(start_station, dest_station)
+        if start_station.region == dest_station.region:
+            different_regions = 0
+        else:
+            different_regions = 1
+        journey_fare += fare_price(distance, different_regions, hubs_in_dest_region)
+
+    if len(journey) >= 3: # for 3-4 leg case, journey is always between regions so the middle leg is hub to hub
+        start_hub = closest_hub(start_station)
+        end_hub = closest_hub(dest_station)
+
+        distance = distance_between(start_station, start_hub)
+        journey_fare += fare_price(distance, 0, hub_counts[start_hub.region])
+        if len(journey) == 3:
+            journey_fare += -1 #account for 3 leg hub to station and station to hub behaviour
+
+        distance = distance_between(start_hub, end_hub)
+        #dr is 1, hub in dest region is same region as dest
+        journey_fare += fare_price(distance, 1, hubs_in_dest_region)
+        distance = distance_between(end_hub, dest_station)
+        #dr is 0
+        journey_fare += fare_price(distance, 0, hubs_in_dest_region) 
+
+    return journey_fare
+
+
 class Station:
+    __slots__ = ('name', 'region', 'crs', 'lat', 'lon', 'hub', '_versions') #no per-station __dict__, large networks hold a lot of these
+
     def __init__(self, name:str, region:str, crs:str, lat:float, lon:float, hub:{int,bool}):
         self.name = name
         self.region = region                
@@ -49,16 +126,7 @@ class Station:
 
 
     def distance_to(self, other_station):
-        #splitting equation for easier readability and error checking
-        lat_dif = (other_station.lat - self.lat)*0.5
-        lon_dif = (other_station.lon - self.lon)*0.5
-
-        #multiplying by pi/180 to convert from radian to degrees
-        k_1 = math.sqrt((math.sin(lat_dif*math.pi/180))**2 + 
-                        ((math.cos(self.lat*math.pi/180)*math.cos(other_station.lat*math.pi/180))*(math.sin(lon_dif*math.pi/180))**2))
-        
-        R = 6371 #declaring R as constant in case earth explodes and loses width
-        distance = abs(2*R*math.asin(k_1)) #abs to prevent negative distances
+        distance = haversine(self.lat, self.lon, other_station.lat, other_station.lon)
 
         if self == other_station:
             distance = 0 #account for case where stations are the same, but don't flag error
@@ -66,29 +134,840 @@ class Station:
         return distance
 
 
+class StationVersion:
+    '''
+    Count of the edits made to the stations of a network, see OwnedStation
+    '''
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+
+class OwnedStation(Station):
+    '''
+    A Station held by a network that keeps Station objects. Setting any field counts as an edit in the StationVersion of
+    each network holding it (_versions), so those networks notice edits such as station.hub = 1 and rebuild what they
+    worked out from their stations. Networks turn their Stations into OwnedStations as they take them in, so Stations
+    not held by any network have no hook on setting a field. Copies and pickles are plain Stations.
+    '''
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        for version in self._versions:
+            version.count += 1
+
+    def __reduce__(self):
+        return (Station, (self.name, self.region, self.crs, self.lat, self.lon, self.hub))
+
+
+class StationColumns:
+    '''
+    Column based copy of a set of stations, with one typed array per field kept in crs insertion order.
+    Region names are interned so each station only stores a small region id.
+    The numeric columns can also be read-only numpy arrays (e.g. memory-mapped from a binary file),
+    they are copied into typed arrays the first time the columns are changed.
+    '''
+    def __init__(self, stations=()):
+        self.crs = []
+        self.names = []
+        self.region_names = []
+        self.region = array('H') #region id, index into region_names
+        self.lat = array('d')
+        self.lon = array('d')
+        self.hub = array('b')
+        self.index = {} #crs to row
+        self.closest = None #optional precomputed closest hub row for each station, dropped when the columns change
+        self._region_ids = {}
+
+        for station in stations:
+            self.append(station.name, station.region, station.crs, station.lat, station.lon, station.hub)
+
+    @classmethod
+    def from_arrays(cls, crs:list, names:list, region_names:list, region, lat, lon, hub, closest=None):
+        '''
+        Function makes columns around existing arrays without copying them, the values are expected to be checked already
+        '''
+        columns = cls()
+        columns.crs, columns.names, columns.region_names = crs, names, region_names
+        columns.region, columns.lat, columns.lon, columns.hub = region, lat, lon, hub
+        columns.index = dict(zip(crs, range(len(crs))))
+        columns.closest = closest
+        columns._region_ids = {region: i for i, region in enumerate(region_names)}
+        return columns
+
+    def _writable(self):
+        '''
+        Function copies read-only numeric columns into typed arrays before a change, and drops the closest hub rows
+        '''
+        self.closest = None
+        if not isinstance(self.lat, array):
+            self.region = array('H', bytes(self.region.astype('=u2')))
+            self.lat = array('d', bytes(self.lat.astype('=f8')))
+            self.lon = array('d', bytes(self.lon.astype('=f8')))
+            self.hub = array('b', bytes(self.hub.astype('=i1')))
+
+    def hub_rows(self):
+        '''
+        Function returns the rows of the hubs, in order
+        '''
+        return [row for row, hub in enumerate(self.hub) if hub]
+
+    def __len__(self):
+        return len(self.crs)
+
+    def region_id(self, region:str):
+        '''
+        Function returns the interned id of a region name, adding it if it is new
+        '''
+        if region not in self._region_ids:
+            self._region_ids[region] = len(self.region_names)
+            self.region_names.append(region)
+        return self._region_ids[region]
+
+    def append(self, name:str, region:str, crs:str, lat:float, lon:float, hub):
+        '''
+        Function adds one station to the end of the columns
+        '''
+        self._writable()
+        if crs in self.index: raise(KeyError('There are duplicate CRS values, no stations can have the same identifier.'))
+        self.index[crs] = len(self.crs)
+        self.crs.append(crs)
+        self.names.append(name)
+        self.region.append(self.region_id(region))
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.hub.append(int(float(hub) == 1))
+
+    def extend(self, names:list, regions:list, crs:list, lat, lon, hub):
+        '''
+        Function adds many stations at once from whole columns, the values are expected to be checked already.
+        lat and lon are sequences of floats and hub a sequence of 0/1
+        '''
+        self._writable()
+        first = len(self.crs)
+        new_index = dict(zip(crs, range(first, first + len(crs))))
+        if len(new_index) != len(crs) or not self.index.keys().isdisjoint(new_index):
+            raise(KeyError('There are duplicate CRS values, no stations can have the same identifier.'))
+        self.index.update(new_index)
+        self.crs.extend(crs)
+        self.names.extend(names)
+        region_ids = {region: self.region_id(region) for region in set(regions)} #look each name up once
+        self.region.extend(array('H', map(region_ids.__getitem__, regions)))
+        self.lat.extend(lat)
+        self.lon.extend(lon)
+        self.hub.extend(hub)
+
+    def replace(self, row:int, name:str, region:str, lat:float, lon:float, hub):
+        '''
+        Function overwrites the fields of the station in a row, keeping its crs and position
+        '''
+        self._writable()
+        self.names[row] = name
+        self.region[row] = self.region_id(region)
+        self.lat[row] = lat
+        self.lon[row] = lon
+        self.hub[row] = int(float(hub) == 1)
+
+    def remove(self, crs:str):
+        '''
+        Function deletes the row of a station, the rows after it move up by one
+        '''
+        self._writable()
+        row = self.index.pop(crs)
+        for column in (self.crs, self.names, self.region, self.lat, self.lon, self.hub):
+            del column[row]
+        for later in range(row, len(self.crs)):
+            self.index[self.crs[later]] = later
+
+    def station(self, row:int):
+        '''
+        Function makes a lightweight Station for a row, the values were checked when the row was added so are not checked again
+        '''
+        station = Station.__new__(Station)
+        station.name = self.names[row]
+        station.region = self.region_names[self.region[row]]
+        station.crs = self.crs[row]
+        station.lat = self.lat[row]
+        station.lon = self.lon[row]
+        station.hub = self.hub[row]
+        return station
+
+    def matches(self, station):
+        '''
+        Function checks a station is the one stored under its crs, and not a different station sharing the code
+        '''
+        row = self.index.get(station.crs)
+        return (row is not None and self.lat[row] == station.lat and self.lon[row] == station.lon
+                and self.region_names[self.region[row]] == station.region and self.hub[row] == int(float(station.hub) == 1))
+
+    def regions(self):
+        '''
+        Function returns the names of the regions that still have stations
+        '''
+        return [self.region_names[region] for region in set(self.region)]
+
+
+class FareCache:
+    '''
+    Bounded least recently used cache, used by RailNetwork for planned journeys and fares.
+    Counts hits, misses, evictions and how many times it was cleared because the network changed.
+    '''
+    def __init__(self, maxsize:int=4096):
+        if not isinstance(maxsize, int) or maxsize < 1: raise(ValueError('maxsize must be a positive int'))
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''
+        Function returns the value kept for key, or None, and marks it as most recently used
+        '''
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''
+        Function keeps a value, dropping the least recently used entry when the cache is full
+        '''
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        '''
+        Function empties the cache after the network changes
+        '''
+        if self.entries:
+            self.entries.clear()
+            self.invalidations += 1
+
+    def discard(self, stale):
+        '''
+        Function drops the entries whose (kind, start, dest) key stale returns True for, after part of the network changes
+        '''
+        keys = [key for key in self.entries if stale(key)]
+        for key in keys:
+            del self.entries[key]
+        if keys:
+            self.invalidations += 1
+
+    def stats(self):
+        '''
+        Function returns the cache counters as a dict
+        '''
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations,
+                'hit_rate': self.hits/lookups if lookups else 0.}
+
+
+class StationView(MutableMapping):
+    '''
+    Mapping of crs to Station used for RailNetwork.stations on a compact network.
+    The stations live in a StationColumns and a Station is only made when one is looked up, so each lookup gives a new object.
+    '''
+    def __init__(self, network, columns:StationColumns):
+        self.network = network
+        self.columns = columns
+
+    def __getitem__(self, crs:str):
+        return self.columns.station(self.columns.index[crs])
+
+    def __contains__(self, crs):
+        return crs in self.columns.index
+
+    def __iter__(self):
+        return iter(list(self.columns.crs)) #copy so the network can change while iterating
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __setitem__(self, crs:str, station):
+        if crs != station.crs: raise(KeyError('crs key does not match the Station crs'))
+        if crs in self.columns.index:
+            self.columns.replace(self.columns.index[crs], station.name, station.region, station.lat, station.lon, station.hub)
+        else:
+            self.columns.append(station.name, station.region, station.crs, station.lat, station.lon, station.hub)
+        self.network._invalidate()
+
+    def __delitem__(self, crs:str):
+        self.columns.remove(crs)
+        self.network._invalidate()
+
+
+class StationDict(dict):
+    '''
+    dict of crs to Station used for RailNetwork.stations, it tells the network to drop its hub index
+    whenever stations are added, replaced or removed so the index can never go stale.
+    Its Stations are made OwnedStations counting their edits in version, so edits to them are noticed too.
+    '''
+    network = None #set after unpickling too, so items restored before it are ignored
+
+    def __init__(self, network=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.network = network
+        self.version = StationVersion()
+        versions, set_field = (self.version,), object.__setattr__
+        for station in self.values():
+            if type(station) is Station: #inlined own, every new network's Stations go through here
+                set_field(station, '__class__', OwnedStation)
+                set_field(station, '_versions', versions)
+            else:
+                self.own(station)
+
+    def own(self, station):
+        '''
+        Function starts counting the edits to a station in version
+        '''
+        if type(station) is Station:
+            object.__setattr__(station, '__class__', OwnedStation)
+            object.__setattr__(station, '_versions', (self.version,))
+        elif type(station) is OwnedStation and self.version not in station._versions:
+            object.__setattr__(station, '_versions', station._versions + (self.version,))
+
+    def release(self, station):
+        '''
+        Function stops counting the edits to a station that left the dict, it is a plain Station again once no network holds it
+        '''
+        if type(station) is OwnedStation:
+            versions = tuple(version for version in station._versions if version is not self.version)
+            if versions:
+                object.__setattr__(station, '_versions', versions)
+            else:
+                object.__delattr__(station, '_versions')
+                object.__setattr__(station, '__class__', Station)
+
+    def _changed(self):
+        if self.network is not None:
+            self.network._invalidate()
+
+    def __setitem__(self, crs, station):
+        if crs in self:
+            self.release(self[crs])
+        super().__setitem__(crs, station)
+        self.own(station)
+        self._changed()
+
+    def __delitem__(self, crs):
+        self.release(self[crs])
+        super().__delitem__(crs)
+        self._changed()
+
+    def pop(self, *args):
+        station = super().pop(*args)
+        self.release(station)
+        self._changed()
+        return station
+
+    def popitem(self):
+        item = super().popitem()
+        self.release(item[1])
+        self._changed()
+        return item
+
+    def setdefault(self, crs, station=None):
+        if crs not in self:
+            self[crs] = station
+        return self[crs]
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        for station in self.values():
+            self.own(station)
+        self._changed()
+
+    def clear(self):
+        for station in self.values():
+            self.release(station)
+        super().clear()
+        self._changed()
+
+
+HUB_GRID_MIN = 32 #regions with at least this many hubs find the closest hub through a spatial index
+
+
+class HubIndex:
+    '''
+    Index of the hubs in a network, built once from its stations: hubs grouped by region, the hub count per region
+    and the closest hub to each station, which is found the first time it is asked for and cached after that.
+    rank maps crs to position in the network (e.g. StationColumns.index), if not given it is recorded from the stations.
+    It is kept up to date one region at a time as stations are added, removed and changed.
+    '''
+    def __init__(self, stations, rank:dict=None):
+        self.hubs = {} #region to list of hubs, in station order
+        self.rank = {} if rank is None else rank
+        self._own_rank = rank is None #ranks are recorded here rather than kept up to date by the columns
+        self._next_rank = 0
+        for station in stations:
+            if self._own_rank:
+                self.rank[station.crs] = self._next_rank
+                self._next_rank += 1
+            if float(station.hub) == 1:
+                self.hubs.setdefault(station.region, []).append(station)
+
+        self.counts = {region: len(hubs) for region, hubs in self.hubs.items()}
+        self.closest = {} #region to dict of crs to closest hub, filled in by RailNetwork.closest_hub
+        self.grids = {} #region to spatial index of its hubs, only made for regions with many hubs
+
+    def hub_grid(self, region:str):
+        '''
+        Function returns a spatial index of the hubs in a region, built on first use
+        '''
+        if region not in self.grids:
+            from spatial_index import GridIndex
+            self.grids[region] = GridIndex(self.hubs[region])
+        return self.grids[region]
+
+    def add(self, station):
+        '''
+        Function indexes a station added to the end of the network
+        '''
+        if self._own_rank:
+            self.rank[station.crs] = self._next_rank
+            self._next_rank += 1
+        if float(station.hub) == 1:
+            self.add_hub(station)
+
+    def remove(self, station):
+        '''
+        Function drops a station removed from the network
+        '''
+        if float(station.hub) == 1:
+            self.remove_hub(station.crs, station.region)
+        else:
+            self.forget(station.crs, station.region)
+        if self._own_rank:
+            del self.rank[station.crs]
+
+    def add_hub(self, station):
+        '''
+        Function puts a hub into its region in station order, and drops what was worked out from the old hubs of the region
+        '''
+        hubs = self.hubs.setdefault(station.region, [])
+        position = bisect.bisect([self.rank[hub.crs] for hub in hubs], self.rank[station.crs])
+        hubs.insert(position, station)
+        self.counts[station.region] = len(hubs)
+        self.forget_region(station.region)
+
+    def remove_hub(self, crs:str, region:str):
+        '''
+        Function takes a hub out of a region, and drops what was worked out from the old hubs of the region
+        '''
+        hubs = [hub for hub in self.hubs[region] if hub.crs != crs]
+        if hubs:
+            self.hubs[region], self.counts[region] = hubs, len(hubs)
+        else:
+            del self.hubs[region], self.counts[region]
+        self.forget_region(region)
+
+    def forget_region(self, region:str):
+        '''
+        Function drops the closest hubs and hub grid of a region
+        '''
+        self.closest.pop(region, None)
+        self.grids.pop(region, None)
+
+    def forget(self, crs:str, region:str):
+        '''
+        Function drops the cached closest hub of one station
+        '''
+        self.closest.get(region, {}).pop(crs, None)
+
+
 class RailNetwork:
-    def __init__(self, stations:list):
-        self.stations = stations #station input is list
+    '''
+    Network of stations, with the hub index, caches and tables worked out from them kept until the stations change.
+    A network that keeps Station objects (not compact) notices any change: stations added, replaced or removed through
+    stations, add_station, remove_station, set_hub, move_station, and also fields of its own Stations set directly
+    (network.stations['PLY'].hub = 1), see OwnedStation. A compact network makes a new Station on every lookup, so setting
+    a field of one changes nothing; change its stations with set_hub, move_station, add_station and remove_station.
+    '''
+    _cache = None #FareCache, only when enable_cache is used
+    _distance_options = None #DistanceTable arguments, only when enable_distance_table is used
+    _compile = False #whether journey_fare uses the CompiledFares, see compile
+    _version = None #StationVersion of the stations, only for networks that keep Station objects
+    _seen = 0 #version count everything derived from the stations was worked out at
 
+    def __init__(self, stations:list, compact:bool=False):
+        '''
+        compact stores the stations in typed arrays (StationColumns) instead of keeping every Station object,
+        Stations are then made on demand when looked up through the stations mapping.
+        '''
         keys = [] #CRS are unique identifiers
-        for row in range(int(len(self.stations))):
-            keys.append(self.stations[row].crs)
+        for row in range(int(len(stations))):
+            keys.append(stations[row].crs)
 
         #ensure no duplicate CRS    
         if len(keys) != len(set(keys)): raise(KeyError('There are duplicate CRS values, no stations can have the same identifier.')) 
-        stations_dict = {}
-        count = 0
-        for station in self.stations:
-            stations_dict[keys[count]] = station
-            count += 1 #manually counting to prevent use of another loop structure
 
-        #convert stations to dictionary
-        self.stations = stations_dict
+        if compact:
+            self._use_columns(StationColumns(stations))
+        else:
+            stations_dict = {}
+            count = 0
+            for station in stations:
+                stations_dict[keys[count]] = station
+                count += 1 #manually counting to prevent use of another loop structure
+
+            #convert stations to dictionary
+            self.stations = stations_dict
+
+        self._hub_index() #index the hubs once up front
+
+    @classmethod
+    def from_columns(cls, columns:StationColumns):
+        '''
+        Function makes a compact network straight from columns (assumed valid), without making any Station objects
+        '''
+        network = cls.__new__(cls)
+        network._use_columns(columns) #hub index is built on first use
+        return network
+
+    def _use_columns(self, columns:StationColumns):
+        self.compact = True
+        self._columns = columns
+        self._stations = StationView(self, columns)
+        self._version = None
+        self._invalidate()
+
+    @property
+    def stations(self):
+        return self._stations
+
+    @stations.setter
+    def stations(self, stations:dict):
+        self.compact = False
+        self._stations = StationDict(self, stations)
+        self._version = self._stations.version
+        self._invalidate()
+
+    def _invalidate(self):
+        '''
+        Function drops the indexes and cached fares after the stations change, they are rebuilt on next use
+        '''
+        if self._version is not None:
+            self._seen = self._version.count
+        if self._cache is not None:
+            self._cache.clear()
+        self._index = None
+        self._spatial = None
+        self._tables = None
+        self._graph = None
+        self._distances = None
+        self._compiled = None
+        if not self.compact:
+            self._columns = None
+
+    def _check_stations(self):
+        '''
+        Function notices stations edited in place (e.g. a hub flag changed) and drops everything derived from them
+        '''
+        if self._version is not None and self._version.count != self._seen:
+            self._invalidate()
+
+    def invalidate(self):
+        '''
+        Function drops everything derived from the stations, for changes the network cannot notice itself,
+        e.g. a Station subclass edited in place
+        '''
+        self._invalidate()
+
+    def _hub_index(self):
+        version = self._version
+        if version is not None and version.count != self._seen: #_check_stations inlined, this runs several times per fare
+            self._invalidate()
+        if self._index is None:
+            if self.compact: #only make Station objects for the hubs
+                columns = self._columns
+                self._index = HubIndex((columns.station(row) for row in columns.hub_rows()), columns.index)
+            else:
+                self._index = HubIndex(self.stations.values())
+        return self._index
+
+    def _fare_tables(self):
+        '''
+        Function returns the per-station arrays the vectorised fare functions use, built on first use
+        '''
+        self._check_stations()
+        if self._tables is None:
+            from fare_engine import FareTables #numpy is only needed for the vectorised functions
+            columns = self.columns()
+            self._tables = FareTables(columns, columns.closest)
+        return self._tables
+
+    def _route_graph(self):
+        '''
+        Function returns the graph route searches over, built on first use
+        '''
+        self._check_stations()
+        if self._graph is None:
+            from routing import RouteGraph
+            self._graph = RouteGraph(self.columns())
+        return self._graph
+
+    def enable_cache(self, maxsize:int=4096):
+        '''
+        Function turns on a least recently used cache of planned journeys and fares, holding up to maxsize entries.
+        The cache is emptied whenever stations are added, removed or edited (see the class docstring).
+        '''
+        self._cache = FareCache(maxsize)
+
+    def disable_cache(self):
+        '''
+        Function turns the journey and fare cache off
+        '''
+        self._cache = None
+
+    def cache_stats(self):
+        '''
+        Function returns the hit, miss and eviction counts of the cache, None if it is not enabled
+        '''
+        return None if self._cache is None else self._cache.stats()
+
+    def enable_distance_table(self, path=None, tiled:bool=None, tile:int=512):
+        '''
+        Function turns on a precomputed float32 table of the distance between every pair of stations, which journey_fare
+        then looks distances up in. It is built on first use and again after stations are added, removed or moved.
+        Up to 8192 stations it is a condensed triangle in memory (N(N-1)/2 x 4 bytes, one float32 per unordered pair), larger networks
+        or any given a path use a tiled memory-mapped file. Distances are within 0.06 m per 1000 km of the float64 ones,
+        so fares round to the same pence unless within about 0.001p of a half penny. Closest hubs are still chosen with
+        float64 distances, so journeys never change. See distance_table for the trade-off.
+        '''
+        self._distance_options = (path, tiled, tile)
+        self._distances = None
+
+    def disable_distance_table(self):
+        '''
+        Function turns the distance table off, journey_fare goes back to Station.distance_to
+        '''
+        self._distance_options = None
+        self._distances = None
+
+    def distance_table(self):
+        '''
+        Function returns the distance table, None if it is not enabled
+        '''
+        self._check_stations()
+        if self._distance_options is not None and self._distances is None:
+            from distance_table import DistanceTable
+            self._distances = DistanceTable(self.columns(), *self._distance_options)
+        return self._distances
+
+    def compile(self):
+        '''
+        Function freezes the network into integer station ids and flat lists of regions, hub counts, closest hubs and hub
+        to hub fares, and has journey_fare price from them, skipping the crs checks, journey planning and hub lookups.
+        Fares are identical to the uncompiled ones (worked out in float64 even with the distance table enabled), an unknown
+        crs raises KeyError. The tables are compiled again on first use after stations change. Returns the CompiledFares.
+        On synthetic networks of 3,000 to 20,000 stations a compiled journey_fare is about 8 to 13 times faster
+        (7-8us down to 0.5-1us), CompiledFares.fare_ids about 16 to 18 times.
+        '''
+        self._compile = True
+        return self.compiled_fares()
+
+    def decompile(self):
+        '''
+        Function turns the compiled mode off, journey_fare goes back to planning each journey
+        '''
+        self._compile = False
+        self._compiled = None
+
+    def compiled_fares(self):
+        '''
+        Function returns the CompiledFares, None if the network is not compiled
+        '''
+        self._check_stations()
+        if self._compile and self._compiled is None:
+            from compiled_fares import CompiledFares
+            self._compiled = CompiledFares(self)
+        return self._compiled
+
+    def distance(self, crs_a:str, crs_b:str):
+        '''
+        Function returns the distance in km between two stations of the network, from the distance table when it is enabled
+        '''
+        table = self.distance_table()
+        if table is not None:
+            return table.distance(crs_a, crs_b)
+        return self.stations[crs_a].distance_to(self.stations[crs_b])
+
+    def _owns(self, s):
+        '''
+        Function checks a station is the network's own, not another station that shares its crs
+        '''
+        if self.compact:
+            return self._columns.matches(s)
+        return self.stations.get(s.crs) is s
+
+    def columns(self):
+        '''
+        Function returns the stations as a StationColumns, this is the storage itself for a compact network
+        and a copy kept until the stations change otherwise
+        '''
+        self._check_stations()
+        if self._columns is None:
+            self._columns = StationColumns(self.stations.values())
+        return self._columns
+
+    def save_binary(self, path, checksum:str=None):
+        '''
+        Function saves the network and its hub index in the compact binary format of binary_network,
+        checksum optionally records the source CSV the network was read from
+        '''
+        from binary_network import save_binary
+        save_binary(self, path, checksum)
+
+    @classmethod
+    def load_binary(cls, path):
+        '''
+        Function loads a network saved by save_binary, its numeric columns are memory-mapped from the file rather than copied
+        '''
+        from binary_network import load_binary
+        return load_binary(path, cls)
+
+    def _region_of(self, crs:str):
+        if self.compact:
+            return self._columns.region_names[self._columns.region[self._columns.index[crs]]]
+        return self._stations[crs].region
+
+    def _regions_changed(self, regions:set, crs:str):
+        '''
+        Function finishes an incremental change to the station crs, dropping the cached journeys and fares that start or end
+        at it or in one of the changed regions. Journeys between other regions do not use anything that changed.
+        '''
+        if self._version is not None:
+            self._seen = self._version.count #every index kept has been brought up to date
+        if self._cache is not None:
+            self._cache.discard(lambda key: crs in key[1:] or self._region_of(key[1]) in regions or self._region_of(key[2]) in regions)
+
+    def add_station(self, station):
+        '''
+        Function adds a station to the network, updating the indexes of its region instead of rebuilding them
+        '''
+        if not isinstance(station, Station): raise(TypeError('data type incorrect for station, expected Station'))
+        self._check_stations()
+        if station.crs in self.stations: raise(KeyError('There are duplicate CRS values, no stations can have the same identifier.'))
+
+        if self.compact:
+            self._columns.append(station.name, station.region, station.crs, station.lat, station.lon, station.hub)
+            station = self.stations[station.crs]
+        else:
+            dict.__setitem__(self._stations, station.crs, station) #skips the StationDict rebuild of every index
+            self._stations.own(station)
+            if self._columns is not None:
+                self._columns.append(station.name, station.region, station.crs, station.lat, station.lon, station.hub)
+
+        if self._index is not None:
+            self._index.add(station)
+        if self._spatial is not None:
+            self._spatial.insert(station)
+        self._tables = None #the vectorised tables, route graph and distance table have a row per station, so are rebuilt on next use
+        self._graph = None
+        self._distances = None
+        self._compiled = None
+        self._regions_changed({station.region}, station.crs)
+
+    def remove_station(self, crs:str):
+        '''
+        Function removes a station from the network, updating the indexes of its region instead of rebuilding them
+        '''
+        self._check_stations()
+        station = self.stations[crs]
+
+        if self._index is not None:
+            self._index.remove(station)
+        if self._spatial is not None:
+            self._spatial.remove(station)
+        if self.compact:
+            self._columns.remove(crs)
+        else:
+            dict.__delitem__(self._stations, crs)
+            self._stations.release(station)
+            if self._columns is not None:
+                self._columns.remove(crs)
+        self._tables = None
+        self._graph = None
+        self._distances = None
+        self._compiled = None
+        self._regions_changed({station.region}, crs)
+
+    def set_hub(self, crs:str, hub:{int,bool}):
+        '''
+        Function makes a station a hub (hub True or 1) or stops it being one (False or 0)
+        '''
+        station = self.stations[crs]
+        self._change_station(crs, station.region, station.lat, station.lon, hub)
+
+    def move_station(self, crs:str, region:str=None, lat:float=None, lon:float=None):
+        '''
+        Function reassigns a station to another region and/or moves it to a new latitude and longitude,
+        anything left as None is kept
+        '''
+        station = self.stations[crs]
+        self._change_station(crs, station.region if region is None else region, station.lat if lat is None else lat,
+                             station.lon if lon is None else lon, station.hub)
+
+    def _change_station(self, crs:str, region:str, lat:float, lon:float, hub):
+        '''
+        Function changes a station in place, then brings the indexes up to date for its old and new region only
+        '''
+        self._check_stations()
+        station = self.stations[crs]
+        old = Station(station.name, station.region, crs, station.lat, station.lon, station.hub) #as it was indexed
+        Station(station.name, region, crs, lat, lon, hub) #checks the new values
+
+        if self.compact:
+            self._columns.replace(self._columns.index[crs], station.name, region, lat, lon, hub)
+            station = self.stations[crs]
+        else: #the network's own Station is changed, so anything holding it sees the change
+            station.region, station.lat, station.lon, station.hub = region, lat, lon, hub
+            if self._columns is not None:
+                self._columns.replace(self._columns.index[crs], station.name, region, lat, lon, hub)
+
+        hubs_changed = float(old.hub) == 1 or float(hub) == 1
+        if self._index is not None:
+            if float(old.hub) == 1:
+                self._index.remove_hub(crs, old.region)
+            else:
+                self._index.forget(crs, old.region)
+            if float(hub) == 1:
+                self._index.add_hub(station)
+        if self._spatial is not None:
+            self._spatial.replace(old, station)
+        if self._tables is not None:
+            self._tables.update({old.region, region})
+        if (lat, lon) != (old.lat, old.lon):
+            self._distances = None
+        self._compiled = None #frozen tables are compiled again on next use
+        if self._graph is not None:
+            if hubs_changed:
+                self._graph = None #hub to hub tables are rebuilt on next use
+            else:
+                self._graph.update()
+        self._regions_changed({old.region, region}, crs)
 
     def regions(self):
         '''
         Function finds the unique regions in a rail network
         '''
+        if self.compact:
+            return self._columns.regions()
+
         region_list = []
         for key in self.stations.keys():
             region_list.append(str(self.stations[key].region))
@@ -113,37 +992,65 @@ class RailNetwork:
         #verify region is string
         if not isinstance(region,str): raise(TypeError('data type incorrect for region, expected str')) 
 
-        hub_stations = {}
-
-        for key in self.stations.keys():
-            if float(self.stations[key].hub) == 1: 
-                hub_stations.setdefault(self.stations[key].region, []).append(self.stations[key])
+        hub_stations = self._hub_index().hubs #copies are returned so callers cannot edit the index
 
         if region == 'all': #default value
-            return hub_stations
-        elif [region in self.regions()]:
-            return hub_stations[region]
+            return {key: list(hubs) for key, hubs in hub_stations.items()}
+        elif region in hub_stations:
+            return list(hub_stations[region])
         else:
-            raise KeyError('Region not in network') #case where region is inputted wrong or does not exist
+            raise KeyError('Region not in network or has no hubs') #case where region is inputted wrong or does not exist
         
 
+    def spatial_index(self):
+        '''
+        Function returns the spatial index of every station in the network, built on first use
+        '''
+        self._check_stations()
+        if self._spatial is None:
+            from spatial_index import GridIndex
+            self._spatial = GridIndex(self.stations.values())
+        return self._spatial
+
+    def nearest(self, lat:float, lon:float, k:int=1):
+        '''
+        Function finds the k stations closest to a point, returned as a list with the closest first
+        '''
+        return self.spatial_index().nearest(lat, lon, k)
+
+    def within_radius(self, lat:float, lon:float, km:float):
+        '''
+        Function finds all stations within km kilometres of a point, returned as a list with the closest first
+        '''
+        return self.spatial_index().within_radius(lat, lon, km)
+
     def closest_hub(self, s):
         '''
         Function takes a station and finds the closest hub to it in the same region.
+        Results for stations in the network are cached in the hub index.
         '''
-        hubs_in_region = self.hub_stations(s.region)
-        min = 1e7
-        for station in hubs_in_region:
-            dist = station.distance_to(s)
-            if dist <= min: #if equidistant then goes alphabetical
-                min = dist
-                # if min == 0:
-                #   continue #station is already hub, no need to codeify or flag since closest_hub is therefore station
-                closest_hub = station
-            elif min == 1e7:
-                closest_hub = []
-                print('No hub in region') #no need since error is in hub_stations, but left in for readability
-
+        index = self._hub_index()
+        cached = self._owns(s) #other stations could share a crs, so are never cached
+        if cached and s.crs in index.closest.get(s.region, ()):
+            return index.closest[s.region][s.crs]
+
+        if s.region not in index.hubs: raise KeyError('Region not in network or has no hubs')
+        hubs_in_region = index.hubs[s.region]
+        if cached and self.compact and self._columns.closest is not None: #precomputed, e.g. loaded from a binary file
+            closest_hub = self._columns.station(int(self._columns.closest[self._columns.index[s.crs]]))
+        elif len(hubs_in_region) >= HUB_GRID_MIN: #large regions only measure the hubs near the station
+            nearby = index.hub_grid(s.region).search_nearest(s.lat, s.lon)
+            closest_hub = min(nearby, key=lambda found: (found[0], -found[1]))[2] #ties go to the later hub, as below
+        else:
+            min_dist = 1e7
+            for station in hubs_in_region:
+                dist = station.distance_to(s)
+                if dist <= min_dist: #if equidistant then goes alphabetical
+                    min_dist = dist
+                    closest_hub = station
+
+        if cached:
+            index.closest.setdefault(s.region, {})[s.crs] = closest_hub
         return closest_hub
 
     
@@ -154,22 +1061,23 @@ class RailNetwork:
         if not (isinstance(start, str) or isinstance(dest, str)): raise(TypeError('crs must be 3 letter string'))
         if not (len(start) == 3 and len(dest) == 3): raise(ValueError('crs must be 3 letter string'))
 
-        # find closest hub
-        start_closest_hub = self.closest_hub(self.stations[start])
-        end_closest_hub = self.closest_hub(self.stations[dest]) 
+        if self._cache is not None:
+            self._check_stations()
+            journey = self._cache.get(('journey', start, dest))
+            if journey is not None:
+                return list(journey) #copy so callers cannot edit the cached journey
 
-        journey = []
-        journey.append(self.stations[start]) #start is always included
+        start_station = self.stations[start]
+        dest_station = self.stations[dest]
 
-        #append if journey is inbetween regions
-        if start_closest_hub != self.stations[start] and start_closest_hub.region != end_closest_hub.region:
-            journey.append(start_closest_hub)
-   
-        if end_closest_hub != self.stations[dest] and end_closest_hub.region != start_closest_hub.region:
-            journey.append(end_closest_hub)
+        # find closest hub
+        start_closest_hub = self.closest_hub(start_station)
+        end_closest_hub = self.closest_hub(dest_station) 
 
-        journey.append(self.stations[dest]) #end is included due to 'clerical error in assignment'
+        journey = plan_journey(start_station, dest_station, start_closest_hub, end_closest_hub)
 
+        if self._cache is not None:
+            self._cache.put(('journey', start, dest), list(journey))
         return journey
         
 
@@ -177,50 +1085,28 @@ class RailNetwork:
         '''
         Function takes start and destination as crs values and returns the cost of the journey. 
         Summary is true to output more information and show the journey passage. 
+        With the cache enabled the fare is kept, so a summary of a cached journey only does the formatting.
+        A compiled network (see compile) prices it from its frozen tables instead.
         '''
-
-        journey = self.journey_planner(start, dest)
-        journey_fare = 0 #if 1 leg, then no cost
-
-        if len(journey) == 2: # for simple 2 leg case
-            distance = self.stations[start].distance_to(self.stations[dest])
-            if self.stations[start].region == self.stations[dest].region:
-                different_regions = 0
-            else:
-                different_regions = 1
-            hubs_in_dest_region = len(self.hub_stations(self.stations[dest].region))
-            journey_fare += fare_price(distance, different_regions, hubs_in_dest_region)
-
-        if len(journey) >= 3: # for 3-4 leg case, selection structure instead of for loop for ease of visualisation
-            distance = self.stations[start].distance_to(self.closest_hub(self.stations[start]))
-            hubs_in_dest_region = len(self.hub_stations(self.closest_hub(self.stations[start]).region))
-            journey_fare += fare_price(distance, 0, hubs_in_dest_region)
-            if len(journey) == 3:
-                journey_fare += -1 #account for 3 leg hub to station and station to hub behaviour
-
-            if self.closest_hub(self.stations[start]).region == self.stations[dest].region: # 3 leg case- start/end xor hub 
-                distance = self.closest_hub(self.stations[start]).distance_to(self.stations[dest])
-                if self.closest_hub(self.stations[start]).region == self.stations[dest].region:
-                    different_regions = 0
-                else:
-                    different_regions = 1
-                hubs_in_dest_region = len(self.hub_stations(self.stations[dest].region))
-                journey_fare += fare_price(distance, different_regions, hubs_in_dest_region)
-
-            elif self.closest_hub(self.stations[start]).region != self.stations[dest].region: # 4 leg case- middle 2 are hubs
-                distance = self.closest_hub(self.stations[start]).distance_to(self.closest_hub(self.stations[dest]))
-                #dr is 1
-                hubs_in_dest_region = len(self.hub_stations(self.stations[dest].region)) #hub in dest region is same region as dest
-                journey_fare += fare_price(distance, 1, hubs_in_dest_region)
-                distance = self.closest_hub(self.stations[dest]).distance_to(self.stations[dest])
-                #dr is 0
-                hubs_in_dest_region = len(self.hub_stations(self.stations[dest].region))
-                journey_fare += fare_price(distance, 0, hubs_in_dest_region) 
-        
-
-
+        if self._compile and not summary:
+            if self._version is not None and self._version.count != self._seen:
+                self._invalidate()
+            compiled = self._compiled
+            if compiled is None:
+                compiled = self.compiled_fares()
+            return compiled.fare(start, dest)
+
+        journey_fare = None
+        if self._cache is not None:
+            self._check_stations()
+            journey_fare = self._cache.get(('fare', start, dest))
+        if journey_fare is None:
+            journey_fare = self._price_journey(start, dest)
+            if self._cache is not None:
+                self._cache.put(('fare', start, dest), journey_fare)
 
         if summary == True: 
+            journey = self.journey_planner(start, dest)
             journey_disp = ""
 
             for i in range(len(journey)):
@@ -234,10 +1120,151 @@ class RailNetwork:
             return f"Journey from: {self.stations[start].name} ({start}) to {self.stations[dest].name} ({dest})\n" f"Route: {journey_disp} \n" f"Fare: £{round(journey_fare, 2):.2f}"
         else:
             return journey_fare
+
+    def _price_journey(self, start:str, dest:str):
+        '''
+        Function works out the fare of a journey leg by leg, see journey_fare
+        '''
+        journey = self.journey_planner(start, dest)
+        table = self.distance_table()
+        if table is None:
+            distance_between = lambda a, b: a.distance_to(b)
+        else: #stations here are the network's own, so are in the table
+            distance_between = lambda a, b: table.distance(a.crs, b.crs)
+        #closest hubs and hub counts come from the hub index, so each is only looked up once
+        return price_journey(journey, self.closest_hub, self._hub_index().counts, distance_between)
+
+    def route(self, start:str, dest:str, weight:str='fare'):
+        '''
+        Function finds the cheapest route from start to dest (crs) through any number of hubs, rather than only the closest ones
+        as journey_planner does. Stations other than hubs only link to the hubs in their own region, hubs link to every hub.
+        weight is 'fare' to sum the fare_price of each leg or 'distance' to sum the km.
+        Returns the list of stations on the route and its cost.
+        '''
+        if weight not in ('fare', 'distance'): raise(ValueError('weight must be fare or distance'))
+        columns = self.columns()
+        rows, cost = self._route_graph().route(columns.index[start], columns.index[dest], weight)
+        if rows is None: raise KeyError('Region not in network or has no hubs')
+        return [self.stations[columns.crs[row]] for row in rows], cost
+
+    def fare_matrix(self, workers:int=1):
+        '''
+        Function calculates the fare for every start/destination pair in the network in one vectorised pass.
+        Returns an N x N numpy array (rows are start stations, columns are destinations) and the list of crs giving the row/column order.
+        Fares match journey_fare, pairs touching a region with no hub cannot be travelled and are nan.
+        workers above 1 splits the destination columns over a process pool (None for one per CPU), giving the same result.
+        '''
+        tables = self._fare_tables()
+        if workers == 1:
+            return tables.matrix(), list(tables.columns.crs)
+
+        from parallel_fares import parallel_matrix
+        return parallel_matrix(tables, workers), list(tables.columns.crs)
+
+    def journey_fares(self, pairs, routes:bool=False, workers:int=1):
+        '''
+        Function prices many journeys at once. pairs is an iterable of (start, dest) crs, or an n x 2 array of them.
+        Returns a numpy array of the fares in the same order, nan where a region has no hub. With routes True it also returns
+        the crs of the stations on each journey as journey_planner plans it (None where there is no route).
+        workers above 1 prices slices of the pairs in a process pool (None for one per CPU).
+        '''
+        from fare_engine import journey_fares
+        return journey_fares(self._fare_tables(), pairs, routes, workers)
+
+    def what_if(self, candidates, workers:int=1, deltas:bool=True):
+        '''
+        Function evaluates candidate changes to the network without making them. A candidate is a crs, which flips that
+        station's hub flag, or a dict of crs to changes such as {'PRE': {'hub': True}, 'BNG': {'region': 'North West'}}.
+        Only the pairs starting or ending at a station whose closest hub, region or hubs in region changes are repriced.
+        Returns a dict for each candidate of its changes, stats (pairs changed, increases, decreases, total/mean/max deltas,
+        pairs that become priced or unpriced) and with deltas True the origin, dest, old, new and delta of every changed fare.
+        workers above 1 evaluates the candidates in a process pool (None for one per CPU).
+        '''
+        from what_if import what_if
+        return what_if(self._fare_tables(), candidates, workers, deltas)
+
+    def iter_fares_to(self, crs:str, chunks:bool=False, chunk_size:int=4096):
+        '''
+        Function lazily yields (origin, dest, fare) for the journey from every other station to crs, nan where a region has no hub.
+        Fares are worked out chunk_size stations at a time, with chunks True each chunk is yielded as numpy columns
+        (origins, dests, fares) instead of tuples.
+        '''
+        from fare_stream import fares_to_chunks, as_tuples, check_chunk_size
+        check_chunk_size(chunk_size)
+        stream = fares_to_chunks(self._fare_tables(), crs, chunk_size)
+        return stream if chunks else as_tuples(stream)
+
+    def iter_fares_from(self, crs:str, chunks:bool=False, chunk_size:int=4096):
+        '''
+        Function lazily yields (origin, dest, fare) for the journey from crs to every other station, see iter_fares_to
+        '''
+        from fare_stream import fares_from_chunks, as_tuples, check_chunk_size
+        check_chunk_size(chunk_size)
+        stream = fares_from_chunks(self._fare_tables(), crs, chunk_size)
+        return stream if chunks else as_tuples(stream)
+
+    def iter_all_fares(self, chunk_size:int=64, chunks:bool=False):
+        '''
+        Function lazily yields (origin, dest, fare) for every journey between two different stations, nan where a region has no hub.
+        Fares are worked out for chunk_size start stations at a time, so memory holds about chunk_size x N fares,
+        with chunks True each chunk is yielded as numpy columns (origins, dests, fares) instead of tuples.
+        '''
+        from fare_stream import all_fares_chunks, as_tuples, check_chunk_size
+        check_chunk_size(chunk_size)
+        stream = all_fares_chunks(self._fare_tables(), chunk_size)
+        return stream if chunks else as_tuples(stream)
+
+    def export_fares(self, path, fmt:str='csv', chunk_size:int=64):
+        '''
+        Function writes the fare of every journey between two different stations without holding them all in memory,
+        fmt 'csv' writes one CSV file with an origin,dest,fare header, 'npy' writes origin.npy, dest.npy and fare.npy
+        columns into the directory path. Returns the number of fares written.
+        '''
+        from fare_stream import write_csv, write_columns
+        if fmt not in ('csv', 'npy'): raise(ValueError('fmt must be csv or npy'))
+        stream = self.iter_all_fares(chunk_size, chunks=True)
+        if fmt == 'csv':
+            return write_csv(stream, path)
+        return write_columns(stream, path, self.n_stations*(self.n_stations - 1))
+
+    def shard(self, processes:int=None, compact:bool=None, context=None):
+        '''
+        Function splits the network into one shard per region and returns a ShardedNetwork that answers journey_planner
+        and journey_fare from the shards of the journey's two ends. processes spreads the shards over that many worker
+        processes (started with the multiprocessing context given), None keeps them in this process. Close it when done.
+        '''
+        from sharding import ShardedNetwork
+        return ShardedNetwork(self, processes, compact, context)
+
+    def save_fare_snapshot(self, path, label:str=None, chunk_rows:int=256):
+        '''
+        Function writes the fare table of the network, in whole pence, to a chunked binary snapshot with a hash per chunk of
+        chunk_rows rows. label records the version of the network. Returns the number of chunks written.
+        '''
+        from fare_snapshot import write_snapshot
+        return write_snapshot(self._fare_tables(), path, label, chunk_rows)
+
+    def diff_fare_snapshot(self, path, full:bool=False):
+        '''
+        Function compares the fares of the network with a snapshot, working out only the fares starting or ending at the
+        stations that changed (all fares with full True). Returns the added, removed and changed stations and the origin,
+        dest, old and new fares of every journey whose fare changed, see fare_snapshot.diff.
+        '''
+        from fare_snapshot import FareSnapshot, NetworkFares, diff
+        return diff(FareSnapshot(path), NetworkFares(self._fare_tables()), full)
+
+    def render_fare_reports(self, out_dir, fmt:str='png', workers:int=1, fares=None, crs=None, **args):
+        '''
+        Function saves the histogram plot_fares_to would draw for every station to out_dir as png or svg files, without opening
+        any window, so it can run in batch jobs. fares and crs optionally give a precomputed fare_matrix to plot from.
+        workers above 1 renders the stations in a process pool (None for one per CPU). Returns the number of files written.
+        **args are used for the hist plot
+        '''
+        from fare_reports import render_fare_reports
+        return render_fare_reports(self, out_dir, fmt, workers, fares, crs, **args)
         
         
 
-
     def plot_fares_to(self, crs_code:str, save:bool, **args):
         """
         Function to plot all fares to one specific station. 
@@ -245,30 +1272,8 @@ class RailNetwork:
         save is true for image to be saved locally to computer
         **args are used for the hist plot
         """
-        if not isinstance(save, bool): raise TypeError('save must be bool')
-
-        fares = []
-        for station in self.stations.values(): 
-            if crs_code != station.crs: #ensure not checking self
-                if [station.region in self.hub_stations().keys()]: #ensure station can be travelled to
-                    fares.append(self.journey_fare(station.crs, crs_code))
-        
-        station_name = self.stations[crs_code].name.replace(" ", "_")
-        plt.title(f"Fare prices to {station_name}")
-        plt.xlabel("Fare price (Pound)")
-
-        if args != None: 
-           fig = plt.hist(fares, **args)
-        else:
-           fig = plt.hist(fares)
-
-        if save:
-           fig = plt.savefig(f"./Fare_prices_to_{station_name}.png")
-        
-        plt.waitforbuttonpress(0)
-
-        
-        return fig
+        from plotting import plot_fares_to #matplotlib is only loaded when something is plotted
+        return plot_fares_to(self, crs_code, save, **args)
 
     def plot_network(self, marker_size: int = 5) -> None:
         """
@@ -277,61 +1282,15 @@ class RailNetwork:
 
         The method will produce a matplotlib figure showing the locations of the stations in the network, and
         attempt to use matplotlib.pyplot.show to display the figure.
-
-        This function will not execute successfully until you have created the regions() function.
-        You are NOT required to write tests nor documentation for this function.
         """
-        fig, ax = plt.subplots(figsize=(5, 10))
-        ax.set_xlabel("Longitude (degrees)")
-        ax.set_ylabel("Latitude (degrees)")
-        ax.set_title("Railway Network")
-
-        COLOURS = ["b", "r", "g", "c", "m", "y", "k"]
-        MARKERS = [".", "o", "x", "*", "+"]
-
-        for i, r in enumerate(self.regions()):
-            lats = [s.lat for s in self.stations.values() if s.region == r]
-            lons = [s.lon for s in self.stations.values() if s.region == r]
-
-            colour = COLOURS[i % len(COLOURS)]
-            marker = MARKERS[i % len(MARKERS)]
-            ax.scatter(lons, lats, s=marker_size, c=colour, marker=marker, label=r)
-
-        ax.legend()
-        plt.tight_layout()
-        plt.show()
-        return
+        from plotting import plot_network
+        return plot_network(self, marker_size)
 
     def plot_journey(self, start: str, dest: str) -> None:
         """
         Plot the journey between the start and end stations, on top of the rail network map.
         The start and dest inputs should the strings corresponding to the CRS codes of the
         starting and destination stations, respectively.
-
-        The method will overlay the route that your journey_planner method has found on the
-        locations of the stations in your network, and draw lines to indicate the route.
-
-        This function will not successfully execute until you have written the journey_planner method.
-        You are NOT required to write tests nor documentation for this function.
         """
-        # Plot railway network in the background
-        network_lats = [s.lat for s in self.stations.values()]
-        network_lons = [s.lon for s in self.stations.values()]
-
-        fig, ax = plt.subplots(figsize=(5, 10))
-        ax.scatter(network_lons, network_lats, s=1, c="blue", marker="x")
-        ax.set_xlabel("Longitude (degrees)")
-        ax.set_ylabel("Latitude (degrees)")
-
-        # Compute the journey
-        journey = self.journey_planner(start, dest)
-        plot_title = f"Journey from {journey[0].name} to {journey[-1].name}"
-        ax.set_title(f"Journey from {journey[0].name} to {journey[-1].name}")
-
-        # Draw over the network with the journey
-        journey_lats = [s.lat for s in journey]
-        journey_lons = [s.lon for s in journey]
-        ax.plot(journey_lons, journey_lats, "ro-", markersize=2)
-
-        plt.show()
-        return
+        from plotting import plot_journey
+        return plot_journey(self, start, dest)
@@ -0,0 +1,128 @@
+import numpy as np
+from fare_engine import haversine, fare_prices, column_array
+
+WEIGHTS = ('fare', 'distance')
+
+
+class RouteGraph:
+    '''
+    Graph of a network for multi-hop routing. Every hub links to every other hub, and every other station links only to the hubs
+    of its own region (and to the stations of its region, for a journey that stays inside it).
+    Hub to hub edges are kept as a dense table per weight, built on first use, while the edges of the start and dest
+    stations are worked out for each query. Edges are weighted by distance in km or by the fare_price of the leg,
+    which counts the leg as between regions when its ends are in different regions and uses the hub count of the region it ends in.
+    columns is a StationColumns.
+    '''
+    def __init__(self, columns):
+        self.columns = columns
+        self.hubs = np.flatnonzero(np.asarray(columns.hub, dtype=bool)) #station row of each hub node
+        self.update()
+        self._tables = {}
+        self._shortest = {} #shortest hub to hub edge of each table
+
+    def update(self):
+        '''
+        Function reads the station positions and regions from the columns again, after stations other than hubs changed.
+        A station moved to a new region adds a region with no hubs, so the hub counts are worked out again too.
+        '''
+        self.lat = column_array(self.columns.lat, np.float64)
+        self.lon = column_array(self.columns.lon, np.float64)
+        self.region = np.asarray(self.columns.region, dtype=np.intp)
+        self.hub_counts = np.bincount(self.region[self.hubs], minlength=len(self.columns.region_names))
+
+    def hub_table(self, weight:str='fare'):
+        '''
+        Function returns the hubs x hubs table of edge weights, from the row hub to the column hub
+        '''
+        if weight not in WEIGHTS: raise(ValueError(f'weight must be one of {", ".join(WEIGHTS)}'))
+        if weight not in self._tables:
+            lat, lon, region = self.lat[self.hubs], self.lon[self.hubs], self.region[self.hubs]
+            table = haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+            if weight == 'fare':
+                table = fare_prices(table, region[:, None] != region[None, :], self.hub_counts[region][None, :])
+            np.fill_diagonal(table, np.inf) #no edge from a hub to itself
+            self._tables[weight] = table
+            self._shortest[weight] = table.min() if len(table) > 1 else 0.0
+        return self._tables[weight]
+
+    def _legs(self, row:int, to_row:bool, weight:str):
+        '''
+        Function gives the weight of the edge between a station and every hub, inf where they are not linked.
+        The edge runs from the hub to the station if to_row, otherwise from the station to the hub.
+        '''
+        linked = self.region[self.hubs] == self.region[row]
+        legs = np.full(len(self.hubs), np.inf)
+        hubs = self.hubs[linked]
+        if to_row:
+            distance = haversine(self.lat[hubs], self.lon[hubs], self.lat[row], self.lon[row])
+        else:
+            distance = haversine(self.lat[row], self.lon[row], self.lat[hubs], self.lon[hubs])
+        legs[linked] = distance if weight == 'distance' else fare_prices(distance, 0, self.hub_counts[self.region[row]])
+        legs[self.hubs == row] = 0 #a hub is its own node, so reaching it costs nothing
+        return legs
+
+    def _heuristic(self, dest:int, exits, weight:str):
+        '''
+        Function gives a lower bound on the cost from every hub to dest, exits being the edges from the hubs into dest.
+        For distance it is the straight line distance. For fare a hub must still take its own exit or at least one more
+        leg, which costs 1 or more, and then the cheapest exit.
+        '''
+        if weight == 'distance':
+            return haversine(self.lat[self.hubs], self.lon[self.hubs], self.lat[dest], self.lon[dest])
+        return np.minimum(exits, 1 + exits.min())
+
+    def route(self, start:int, dest:int, weight:str='fare'):
+        '''
+        Function finds the cheapest route from the start row to the dest row with A* search over the hubs.
+        Returns the station rows on the route and its total weight, or (None, inf) if dest cannot be reached.
+        Hubs are settled in order of cost so far, several at once when they are closer together than the shortest hub to hub edge,
+        and only while cost so far plus the heuristic could still beat the best complete route found.
+        '''
+        table = self.hub_table(weight)
+        if start == dest:
+            return [start], 0.0
+
+        best, best_hub = np.inf, None #best complete route and the hub it leaves from, None for direct
+        if self.region[start] == self.region[dest]:
+            distance = haversine(self.lat[start], self.lon[start], self.lat[dest], self.lon[dest])
+            best = float(distance if weight == 'distance' else fare_prices(distance, 0, self.hub_counts[self.region[dest]]))
+
+        cost = self._legs(start, False, weight) #cost so far of reaching each hub
+        exits = self._legs(dest, True, weight)
+        heuristic = self._heuristic(dest, exits, weight)
+        previous = np.full(len(self.hubs), -1)
+        open_hubs = np.isfinite(cost)
+        shortest = self._shortest[weight]
+
+        while True:
+            open_hubs &= cost + heuristic < best #a hub whose lower bound cannot beat the best route is dropped
+            if not open_hubs.any():
+                break
+            if weight == 'fare':
+                #every open hub within the shortest edge (at least 1) of the cheapest one cannot get any cheaper, so they are settled together
+                settled = np.flatnonzero(open_hubs & (cost <= cost[open_hubs].min() + shortest))
+            else: #the distance heuristic is strong enough to settle one hub at a time in A* order
+                settled = np.array([np.argmin(np.where(open_hubs, cost + heuristic, np.inf))])
+            open_hubs[settled] = False
+            leaving = cost[settled] + exits[settled]
+            if leaving.min() < best:
+                best, best_hub = float(leaving.min()), int(settled[np.argmin(leaving)])
+
+            through = cost[settled][:, None] + table[settled]
+            better = np.flatnonzero(through.min(axis=0) < cost)
+            via = np.argmin(through[:, better], axis=0)
+            cost[better] = through[via, better]
+            previous[better] = settled[via]
+            open_hubs[better] = True
+
+        if best == np.inf:
+            return None, np.inf
+        rows = [dest]
+        hub = best_hub
+        while hub is not None and hub >= 0:
+            if self.hubs[hub] != rows[-1]: #a hub at either end is the station itself
+                rows.append(int(self.hubs[hub]))
+            hub = int(previous[hub]) if previous[hub] >= 0 else None
+        if rows[-1] != start:
+            rows.append(start)
+        return rows[::-1], best
@@ -0,0 +1,240 @@
+'''
+Region sharding of a RailNetwork. Fares only depend on the region structure: a journey inside a region only needs that
+region's stations and hubs, and a journey between regions needs the closest hub of each end and the hub counts. So a network
+splits into one shard per region plus a small global HubTable, and a ShardedNetwork router answers journey_planner and
+journey_fare by asking only the shards of the two ends, giving the same journeys and fares as the whole network.
+
+    with network.shard(processes=4) as sharded:
+        sharded.journey_fare('BRI', 'MAN')
+
+Shards are held in this process, or with processes spread over that many worker processes which are sent their stations
+once and then answer requests over a pipe. The shards are a snapshot, changes to the network afterwards are not seen.
+'''
+import multiprocessing
+from railway import RailNetwork, plan_journey, price_journey
+
+METHODS = ('endpoint', 'journey', 'fare')
+
+
+def partition(network):
+    '''
+    Function splits the stations of a network by region, keeping the order of the network in each region
+    '''
+    regions = {}
+    for station in network.stations.values():
+        regions.setdefault(station.region, []).append(station)
+    return regions
+
+
+class HubTable:
+    '''
+    Global table of every hub, the number of hubs in each region and the closest hub of each hub (a hub is nearly always its own),
+    so journeys starting or ending at a hub need no shard at all
+    '''
+    def __init__(self, network):
+        index = network._hub_index()
+        self.counts = dict(index.counts)
+        self.closest = {hub.crs: (hub, network.closest_hub(hub)) for hubs in index.hubs.values() for hub in hubs}
+
+    def __len__(self):
+        return len(self.closest)
+
+
+class LocalShard:
+    '''
+    The network of the stations of one region, answering the requests of a ShardedNetwork
+    '''
+    def __init__(self, stations:list, compact:bool=False):
+        self.network = RailNetwork(stations, compact)
+
+    def endpoint(self, crs:str):
+        '''
+        Function returns a station and its closest hub
+        '''
+        station = self.network.stations[crs]
+        return station, self.network.closest_hub(station)
+
+    def journey(self, start:str, dest:str):
+        return self.network.journey_planner(start, dest)
+
+    def fare(self, start:str, dest:str):
+        return self.network.journey_fare(start, dest)
+
+    def submit(self, method:str, *args):
+        reply = Reply()
+        try:
+            reply.set(getattr(self, method)(*args))
+        except Exception as error:
+            reply.set(None, error)
+        return reply
+
+
+class Reply:
+    '''
+    Reply to a shard request, result waits for it and raises the error the shard raised
+    '''
+    def __init__(self, worker=None):
+        self.worker = worker
+        self.done = False
+
+    def set(self, value, error:Exception=None):
+        self.value, self.error, self.done = value, error, True
+
+    def result(self):
+        while not self.done:
+            self.worker.receive()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _serve(connection, regions:dict, compact:bool):
+    '''
+    Function runs in a worker process, answering (region, method, args) requests for its shards until it is sent None
+    '''
+    shards = {region: LocalShard(stations, compact) for region, stations in regions.items()}
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        region, method, args = request
+        try:
+            if method not in METHODS: raise(ValueError(f'no shard method {method}'))
+            connection.send((getattr(shards[region], method)(*args), None))
+        except Exception as error:
+            connection.send((None, error))
+    connection.close()
+
+
+class ShardWorker:
+    '''
+    A worker process holding the shards of some regions. Requests are sent straight away and replies read in order,
+    so requests to several workers are answered in parallel.
+    '''
+    def __init__(self, regions:dict, compact:bool=False, context=None):
+        context = multiprocessing.get_context(context)
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, regions, compact), daemon=True)
+        self.process.start()
+        child.close()
+        self.waiting = [] #replies not yet received, in the order their requests were sent
+
+    def submit(self, region:str, method:str, *args):
+        self.connection.send((region, method, args))
+        reply = Reply(self)
+        self.waiting.append(reply)
+        return reply
+
+    def receive(self):
+        while not self.connection.poll(1):
+            if not self.process.is_alive(): raise(RuntimeError(f'shard worker exited with code {self.process.exitcode}'))
+        value, error = self.connection.recv()
+        self.waiting.pop(0).set(value, error)
+
+    def close(self):
+        if self.process.is_alive():
+            while self.waiting:
+                self.receive()
+            self.connection.send(None)
+            self.process.join()
+        self.connection.close()
+
+
+class RemoteShard:
+    '''
+    The shard of one region held by a ShardWorker
+    '''
+    def __init__(self, worker:ShardWorker, region:str):
+        self.worker = worker
+        self.region = region
+
+    def submit(self, method:str, *args):
+        return self.worker.submit(self.region, method, *args)
+
+
+def assign_regions(regions:dict, processes:int):
+    '''
+    Function spreads the regions over processes workers, largest region first to the worker with the fewest stations.
+    Returns a list of region to stations dicts, one per worker that has any.
+    '''
+    if not isinstance(processes, int) or processes < 1: raise(ValueError('processes must be a positive int'))
+    workers = [{} for i in range(min(processes, len(regions)))]
+    sizes = [0]*len(workers)
+    for region in sorted(regions, key=lambda region: -len(regions[region])):
+        smallest = sizes.index(min(sizes))
+        workers[smallest][region] = regions[region]
+        sizes[smallest] += len(regions[region])
+    return workers
+
+
+class ShardedNetwork:
+    '''
+    Router over the region shards of a network, see the module docstring. directory maps crs to region.
+    '''
+    def __init__(self, network, processes:int=None, compact:bool=None, context=None):
+        compact = network.compact if compact is None else compact
+        regions = partition(network)
+        self.hubs = HubTable(network)
+        self.directory = {station.crs: region for region, stations in regions.items() for station in stations}
+        self.workers = []
+        if processes is None:
+            self.shards = {region: LocalShard(stations, compact) for region, stations in regions.items()}
+        else:
+            self.shards = {}
+            for assigned in assign_regions(regions, processes):
+                worker = ShardWorker(assigned, compact, context)
+                self.workers.append(worker)
+                self.shards.update({region: RemoteShard(worker, region) for region in assigned})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Function stops the worker processes
+        '''
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
+
+    def regions(self):
+        return list(self.shards)
+
+    def _region(self, crs:str):
+        if not isinstance(crs, str): raise(TypeError('crs must be 3 letter string'))
+        if len(crs) != 3: raise(ValueError('crs must be 3 letter string'))
+        return self.directory[crs]
+
+    def _endpoints(self, start:str, dest:str):
+        '''
+        Function gets both ends of a journey between regions and their closest hubs, from the hub table where an end is a hub
+        and otherwise from its shard, with both shards asked at once
+        '''
+        replies = [self.hubs.closest[crs] if crs in self.hubs.closest else self.shards[self._region(crs)].submit('endpoint', crs)
+                   for crs in (start, dest)]
+        return [reply if isinstance(reply, tuple) else reply.result() for reply in replies]
+
+    def journey_planner(self, start:str, dest:str):
+        '''
+        Function returns the list of stations on the journey from start to dest (crs), as RailNetwork.journey_planner
+        '''
+        region = self._region(start)
+        if region == self._region(dest):
+            return self.shards[region].submit('journey', start, dest).result()
+        (start_station, start_hub), (dest_station, end_hub) = self._endpoints(start, dest)
+        return plan_journey(start_station, dest_station, start_hub, end_hub)
+
+    def journey_fare(self, start:str, dest:str):
+        '''
+        Function returns the fare of the journey from start to dest (crs), as RailNetwork.journey_fare
+        '''
+        region = self._region(start)
+        if region == self._region(dest):
+            return self.shards[region].submit('fare', start, dest).result()
+        (start_station, start_hub), (dest_station, end_hub) = self._endpoints(start, dest)
+        journey = plan_journey(start_station, dest_station, start_hub, end_hub)
+        closest = {start_station.crs: start_hub, dest_station.crs: end_hub}
+        return price_journey(journey, lambda station: closest[station.crs], self.hubs.counts, lambda a, b: a.distance_to(b))
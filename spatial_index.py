@@ -0,0 +1,139 @@
+import math
+from railway import haversine
+
+R = 6371 #same earth radius as haversine
+
+
+def check_point(lat:float, lon:float):
+    '''
+    Function checks a query point has the same ranges as a Station
+    '''
+    if not -90 <= lat <= 90: raise(ValueError('Latitude is not in -90 to 90 range'))
+    if not -180 <= lon <= 180: raise(ValueError('Longitude is not in -180 to 180 range'))
+
+
+class GridIndex:
+    '''
+    Spatial index of stations on a lat/lon grid, for nearest station and radius queries without scanning every station.
+    Stations are bucketed into square cells of cell_deg degrees, a query only measures distances to stations in the cells
+    its search circle overlaps, then filters them with the exact haversine distance.
+    '''
+    def __init__(self, stations=(), cell_deg:float=0.5):
+        if not 0 < cell_deg <= 180 or 360 % cell_deg != 0: raise(ValueError('cell_deg must divide 360 degrees'))
+        self.cell_deg = cell_deg
+        self.n_lon_cells = round(360/cell_deg)
+        self.cells = {} #(lat cell, lon cell) to list of (insertion order, station)
+        self.order = {} #crs to insertion order, used to break distance ties
+        self._count = 0
+
+        for station in stations:
+            self.insert(station)
+
+    def __len__(self):
+        return len(self.order)
+
+    def _lon_cell(self, lon_cell:int):
+        return (lon_cell + self.n_lon_cells//2) % self.n_lon_cells - self.n_lon_cells//2 #wrap around the antimeridian
+
+    def _cell(self, lat:float, lon:float):
+        return (math.floor(lat/self.cell_deg), self._lon_cell(math.floor(lon/self.cell_deg)))
+
+    def insert(self, station, order:int=None):
+        '''
+        Function adds a station to the index, it is placed after every station already indexed unless given an order
+        '''
+        if station.crs in self.order: raise(KeyError(f'{station.crs} is already in the index'))
+        if order is None:
+            order = self._count
+            self._count += 1
+        self.order[station.crs] = order
+        self.cells.setdefault(self._cell(station.lat, station.lon), []).append((order, station))
+
+    def remove(self, station):
+        '''
+        Function removes a station from the index, using the position it was indexed at
+        '''
+        order = self.order.pop(station.crs)
+        cell = self._cell(station.lat, station.lon)
+        self.cells[cell] = [entry for entry in self.cells[cell] if entry[0] != order]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def replace(self, old, new):
+        '''
+        Function swaps the indexed station old (as it was indexed) for new, which may be in another place, keeping its order
+        '''
+        order = self.order[old.crs]
+        self.remove(old)
+        self.insert(new, order)
+
+    def _candidate_cells(self, lat:float, lon:float, km:float):
+        '''
+        Function finds the cells that could hold a station within km of the point
+        '''
+        angle = km/R*(1 + 1e-9) #angular radius of the search circle, padded for rounding at cell edges
+        if angle >= math.pi:
+            return list(self.cells)
+
+        lat_low = math.floor(max(lat - math.degrees(angle), -90)/self.cell_deg)
+        lat_high = math.floor(min(lat + math.degrees(angle), 90)/self.cell_deg)
+
+        #widest longitude span of the circle, every longitude if it reaches over a pole
+        if math.sin(angle) >= math.cos(math.radians(lat)) or abs(lat) + math.degrees(angle) >= 90:
+            lon_cells = None
+        else:
+            lon_span = math.degrees(math.asin(math.sin(angle)/math.cos(math.radians(lat))))
+            lon_low = math.floor((lon - lon_span)/self.cell_deg)
+            lon_high = math.floor((lon + lon_span)/self.cell_deg)
+            if lon_high - lon_low + 1 >= self.n_lon_cells:
+                lon_cells = None
+            else:
+                lon_cells = {self._lon_cell(cell) for cell in range(lon_low, lon_high + 1)}
+
+        n_cells = (lat_high - lat_low + 1)*(self.n_lon_cells if lon_cells is None else len(lon_cells))
+        if n_cells >= len(self.cells): #cheaper to look through the filled cells
+            return [cell for cell in self.cells if lat_low <= cell[0] <= lat_high and (lon_cells is None or cell[1] in lon_cells)]
+        elif lon_cells is None:
+            lon_cells = range(-(self.n_lon_cells//2), self.n_lon_cells - self.n_lon_cells//2)
+        return [(i, j) for i in range(lat_low, lat_high + 1) for j in lon_cells if (i, j) in self.cells]
+
+    def search(self, lat:float, lon:float, km:float):
+        '''
+        Function returns (distance, insertion order, station) for every station within km of the point, unsorted
+        '''
+        found = []
+        for cell in self._candidate_cells(lat, lon, km):
+            for order, station in self.cells[cell]:
+                distance = haversine(station.lat, station.lon, lat, lon)
+                if distance <= km:
+                    found.append((distance, order, station))
+        return found
+
+    def search_nearest(self, lat:float, lon:float, k:int=1):
+        '''
+        Function returns (distance, insertion order, station) for at least the k nearest stations, unsorted.
+        The search circle starts at one cell and doubles until it holds k stations, so every station tied with the k-th is included.
+        '''
+        km = self.cell_deg*math.pi/180*R
+        found = self.search(lat, lon, km)
+        while len(found) < min(k, len(self)) and km < math.pi*R:
+            km *= 2
+            found = self.search(lat, lon, km)
+        return found
+
+    def within_radius(self, lat:float, lon:float, km:float):
+        '''
+        Function returns all stations within km of the point, closest first
+        '''
+        check_point(lat, lon)
+        if km < 0: raise(ValueError('radius must not be negative'))
+        return [station for distance, order, station in sorted(self.search(lat, lon, km), key=lambda found: found[:2])]
+
+    def nearest(self, lat:float, lon:float, k:int=1):
+        '''
+        Function returns the k stations closest to the point, closest first
+        '''
+        check_point(lat, lon)
+        if not isinstance(k, int) or k < 1: raise(ValueError('k must be a positive int'))
+        found = sorted(self.search_nearest(lat, lon, k), key=lambda found: found[:2])
+        return [station for distance, order, station in found[:k]]
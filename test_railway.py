@@ -1,11 +1,19 @@
 #test_railway
 
 from pytest import raises, approx
+import asyncio
+import itertools
+import json
 import math
+import numpy as np
 from pathlib import Path
 import matplotlib.pyplot as plt
-from utilities import read_rail_network
+from utilities import read_rail_network, read_rail_network_fast, write_network_cache, synthetic_stations
 from railway import fare_price, Station, RailNetwork
+import benchmarks
+import instrumentation
+from fare_reports import report_name, render_journeys
+from quote_server import FareQuoter, QuoteServer
 
 # [Done] At least one test for the fare_price function (1 mark)
 
@@ -185,17 +193,777 @@ def test_plot_fares_to_other_args():
    fig, ax = plt.subplots(figsize=(5,5))
    misc_network.plot_fares_to('KGX', save=False, ec='red') #no error
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Tests for fare_matrix
+
+#second network with several hubs per region, kept apart from misc_network since the plot tests edit it
+bristol = Station('Bristol Temple Meads', 'South West', 'BRI', 51.449138, -2.581315, 1)
+exeter = Station('Exeter St Davids', 'South West', 'EXD', 50.729277, -3.543611, 1)
+bath = Station('Bath Spa', 'South West', 'BTH', 51.377538, -2.356996, 0)
+plymouth = Station('Plymouth', 'South West', 'PLY', 50.378023, -4.143549, 0)
+manchester = Station('Manchester Piccadilly', 'North West', 'MAN', 53.477343, -2.230868, 1)
+liverpool = Station('Liverpool Lime Street', 'North West', 'LIV', 53.407375, -2.977788, 1)
+preston = Station('Preston', 'North West', 'PRE', 53.755684, -2.707785, 0)
+euston = Station('London Euston', 'London', 'EUS', 51.528136, -0.133898, 1)
+brixton = Station('Brixton', 'London', 'BRX', 51.463298, -0.114179, 0)
+bangor = Station('Bangor (Gwynedd)', 'Wales', 'BNG', 53.222343, -4.135958, 0)
+
+fare_network = RailNetwork([bristol, exeter, bath, plymouth, manchester, liverpool, preston, euston, brixton, bangor])
+
+def test_fare_matrix_matches_journey_fare():
+   fares, crs = fare_network.fare_matrix()
+   assert fares.shape == (10, 10)
+   for i, start in enumerate(crs):
+      for j, dest in enumerate(crs):
+         if 'BNG' not in (start, dest): #no hub in Wales
+            assert round(fares[i, j], 2) == round(fare_network.journey_fare(start, dest), 2)
+
+def test_fare_matrix_no_hub_region():
+   fares, crs = fare_network.fare_matrix()
+   assert math.isnan(fares[crs.index('BNG'), crs.index('EUS')]) #no route to or from a region without a hub
+   assert math.isnan(fares[crs.index('EUS'), crs.index('BNG')])
+
+# Tests for the hub index
+
+def test_hub_index_rebuilt_on_new_station():
+   network = RailNetwork([bristol, bath, euston])
+   assert network.closest_hub(bath) == bristol
+   keynsham = Station('Keynsham', 'South West', 'KYN', 51.413545, -2.495745, 1)
+   network.stations['KYN'] = keynsham #adding a closer hub must not leave a stale closest hub
+   assert len(network.hub_stations('South West')) == 2
+   assert network.closest_hub(bath) == keynsham
+
+def test_hub_stations_returns_copy():
+   network = RailNetwork([bristol, bath, euston])
+   network.hub_stations('South West').append(bath)
+   assert network.hub_stations('South West') == [bristol]
+
+# Tests for the spatial index
+
+def test_nearest():
+   assert fare_network.nearest(51.45, -2.58) == [bristol] #point next to Bristol Temple Meads
+   assert fare_network.nearest(51.45, -2.58, k=3) == [bristol, bath, exeter]
+
+def test_within_radius():
+   assert fare_network.within_radius(51.5, -0.12, 10) == [euston, brixton] #central London
+   assert fare_network.within_radius(0., 0., 100) == []
+
+def test_within_radius_bad_point():
+   with raises(ValueError, match='Latitude is not in -90 to 90 range'):
+      fare_network.within_radius(91., 0., 10)
+
+def test_closest_hub_large_region():
+   #enough hubs for closest_hub to use the spatial index, answers must match a full scan
+   hubs = [Station(f'Hub {i}', 'Grid', f'H{i:02d}', 50. + (i % 8)*0.3, -3. + (i // 8)*0.4, 1) for i in range(48)]
+   stops = [Station(f'Stop {i}', 'Grid', f'S{i:02d}', 50.1 + (i % 7)*0.31, -2.9 + (i // 7)*0.27, 0) for i in range(49)]
+   network = RailNetwork(hubs + stops)
+   for stop in stops:
+      assert network.closest_hub(stop) == min(hubs, key=lambda hub: hub.distance_to(stop))
+
+# Tests for compact (columnar) networks
+
+compact_network = RailNetwork([bristol, exeter, bath, plymouth, manchester, liverpool, preston, euston, brixton, bangor], compact=True)
+
+def test_station_slots():
+   with raises(AttributeError):
+      bath.platforms = 2 #__slots__ means no new attributes
+
+def test_compact_lookup():
+   station = compact_network.stations['BTH']
+   assert (station.name, station.region, station.lat, station.lon, station.hub) == ('Bath Spa', 'South West', 51.377538, -2.356996, 0)
+   assert 'BTH' in compact_network.stations and 'XXX' not in compact_network.stations
+   assert compact_network.n_stations == 10
+
+def test_compact_regions_and_hubs():
+   assert sorted(compact_network.regions()) == sorted(fare_network.regions())
+   assert [hub.crs for hub in compact_network.hub_stations('North West')] == ['MAN', 'LIV']
+   assert compact_network.closest_hub(plymouth).crs == 'EXD'
+
+def test_compact_journey_fare():
+   for start in ['BTH', 'EXD', 'PRE', 'BRX']:
+      for dest in ['PLY', 'LIV', 'EUS']:
+         assert compact_network.journey_fare(start, dest) == fare_network.journey_fare(start, dest)
+         assert [s.crs for s in compact_network.journey_planner(start, dest)] == [s.crs for s in fare_network.journey_planner(start, dest)]
+
+def test_compact_remove_station():
+   network = RailNetwork([bristol, bath, euston, bangor], compact=True)
+   del network.stations['BNG']
+   assert sorted(network.regions()) == ['London', 'South West']
+   assert list(network.stations) == ['BRI', 'BTH', 'EUS']
+
+# Tests for read_rail_network_fast
+
+def write_csv(path, rows):
+   path.write_text('name,region,crs,latitude,longitude,hub\n' + ''.join(row + '\n' for row in rows))
+   return path
+
+network_rows = ['"Bangor, Gwynedd",Wales,BNG,53.222343,-4.135958,1', 'Bath Spa,South West,BTH,51.377538,-2.356996,0',
+                'Bristol Temple Meads,South West,BRI,51.449138,-2.581315,1', 'London Euston,London,EUS,51.528136,-0.133898,1',
+                'Brixton,London,BRX,51.463298,-0.114179,0']
+
+def test_read_fast_matches_read(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows)
+   slow, fast = read_rail_network(path), read_rail_network_fast(path, chunk_size=16) #small chunks split lines and quotes
+   assert list(fast.stations) == list(slow.stations)
+   assert fast.stations['BNG'].name == 'Bangor, Gwynedd'
+   assert fast.journey_fare('BTH', 'BRX') == slow.journey_fare('BTH', 'BRX')
+
+def test_read_fast_bad_latitude(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows + ['Nowhere,London,NOW,95.0,0.0,0'])
+   with raises(ValueError, match='Latitude is not in -90 to 90 range on rows 7'):
+      read_rail_network_fast(path)
+
+def test_read_fast_not_numeric(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows + ['Nowhere,London,NOW,0.0,west,0'])
+   with raises(ValueError, match='Longitude is not numeric on rows 7'):
+      read_rail_network_fast(path)
+
+def test_read_fast_duplicate_crs(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows + ['Bath Two,South West,BTH,51.3,-2.3,0'])
+   with raises(KeyError, match='Rows 7'):
+      read_rail_network_fast(path)
+
+def test_read_fast_ragged_rows(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows[:2] + ['A,R,AAA,51.0,0.0,1,X', 'R,BBB,52.0,0.0,0'] + network_rows[2:])
+   for chunk_size in (1, 1 << 22): #the rows are caught however the chunks fall, even when their field counts cancel out
+      with raises(ValueError, match='Wrong number of fields on rows 4'):
+         read_rail_network_fast(path, chunk_size=chunk_size)
+
+def test_read_fast_rows_are_file_lines(tmp_path):
+   rows = network_rows[:2] + ['', '"Two line\nname",Wales,TWO,53.0,-4.0,0', 'Nowhere,London,NOW,95.0,0.0,0']
+   path = write_csv(tmp_path / 'stations.csv', rows) #a blank line 4 and a row on lines 5-6, so Nowhere is on line 7
+   for chunk_size in (1, 1 << 22):
+      with raises(ValueError, match='Latitude is not in -90 to 90 range on rows 7$'):
+         read_rail_network_fast(path, chunk_size=chunk_size)
+   write_csv(path, rows[:-1] + ['Nowhere,London,NOW,0.0,west,0', 'Bath Two,South West,BTH,51.3,-2.3,0'])
+   with raises(ValueError, match='Longitude is not numeric on rows 7$'):
+      read_rail_network_fast(path)
+   write_csv(path, rows[:-1] + ['Bath Two,South West,BTH,51.3,-2.3,0'])
+   with raises(KeyError, match='Rows 7'):
+      read_rail_network_fast(path)
+   path.write_bytes(path.read_bytes().replace(b'\n', b'\r\n')) #same lines with csv.writer line ends
+   with raises(KeyError, match='Rows 7'):
+      read_rail_network_fast(path)
+
+def test_read_fast_hub_values_as_read(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows + ['Nowhere,London,NOW,51.0,0.0,True'])
+   with raises(ValueError):
+      read_rail_network(path)
+   with raises(ValueError, match='input incorrect for hub, expected bool or 0/1 on rows 7'):
+      read_rail_network_fast(path)
+
+# Tests for the binary network format
+
+def test_binary_round_trip(tmp_path):
+   fare_network.save_binary(tmp_path / 'network.railnet')
+   loaded = RailNetwork.load_binary(tmp_path / 'network.railnet')
+   assert list(loaded.stations) == list(fare_network.stations)
+   assert loaded.stations['BNG'].name == 'Bangor (Gwynedd)'
+   assert [hub.crs for hub in loaded.hub_stations('South West')] == ['BRI', 'EXD']
+   assert loaded.journey_fare('PLY', 'PRE') == fare_network.journey_fare('PLY', 'PRE')
+
+def test_binary_loaded_network_can_change(tmp_path):
+   fare_network.save_binary(tmp_path / 'network.railnet')
+   loaded = RailNetwork.load_binary(tmp_path / 'network.railnet')
+   loaded.stations['CLJ'] = Station('Clapham Junction', 'London', 'CLJ', 51.464188, -0.170293, 1) #memory-mapped columns are copied first
+   assert loaded.closest_hub(brixton).crs == 'CLJ'
+
+def test_read_uses_cache(tmp_path):
+   path = write_csv(tmp_path / 'stations.csv', network_rows)
+   write_network_cache(path)
+   assert not read_rail_network(path).compact #only used when asked for
+   assert read_rail_network(path, use_cache=True).compact #cache matches so is used
+   write_csv(path, network_rows[1:])
+   assert not read_rail_network(path, use_cache=True).compact #CSV changed so the cache is ignored
+
+# Tests for journey_fares
+
+def test_journey_fares_matches_journey_fare():
+   pairs = [('BTH', 'PLY'), ('EXD', 'LIV'), ('PRE', 'BRX'), ('MAN', 'EUS'), ('BRX', 'BRX')] #2, 3, 4 and hub to hub legs
+   fares, routes = fare_network.journey_fares(pairs, routes=True)
+   for (start, dest), fare, route in zip(pairs, fares, routes):
+      assert fare == approx(fare_network.journey_fare(start, dest))
+      assert route == [station.crs for station in fare_network.journey_planner(start, dest)]
+
+def test_journey_fares_no_hub_region():
+   fares, routes = fare_network.journey_fares([('BNG', 'EUS')], routes=True)
+   assert math.isnan(fares[0]) and routes == [None]
+
+def test_journey_fares_unknown_crs():
+   with raises(KeyError, match='XXX'):
+      fare_network.journey_fares([('BTH', 'XXX')])
+
+def test_journey_fares_empty_network():
+   for compact in (False, True):
+      network = RailNetwork([], compact)
+      assert len(network.journey_fares([])) == 0
+      fares, routes = network.journey_fares([], routes=True)
+      assert len(fares) == 0 and routes == []
+      fares, crs = network.fare_matrix()
+      assert fares.shape == (0, 0) and crs == []
+      with raises(KeyError, match='BRI'):
+         network.journey_fares([('BRI', 'BTH')])
+   assert len(fare_network.journey_fares([])) == 0
+
+# Tests for the journey and fare cache
+
+def test_cache_hits_and_summary():
+   network = RailNetwork([bristol, exeter, bath, plymouth, euston, brixton])
+   network.enable_cache(maxsize=8)
+   fare = network.journey_fare('BTH', 'BRX')
+   assert network.journey_fare('BTH', 'BRX') == fare
+   assert network.journey_fare('BTH', 'BRX', summary=True).endswith(f'Fare: £{round(fare, 2):.2f}')
+   stats = network.cache_stats()
+   assert (stats['hits'], stats['size']) == (3, 2) #second fare, then the summary's fare and journey
+
+def test_cache_evicts_least_recent():
+   network = RailNetwork([bristol, exeter, bath, plymouth])
+   network.enable_cache(maxsize=2)
+   for dest in ['EXD', 'BTH', 'PLY']:
+      network.journey_fare('BRI', dest)
+   assert network.cache_stats()['evictions'] == 4 #each fare also keeps its journey
+   assert network.cache_stats()['size'] == 2
+
+def test_cache_cleared_on_hub_change():
+   stations = [Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in [bristol, exeter, bath, plymouth, euston, brixton]]
+   network = RailNetwork(stations)
+   network.enable_cache()
+   before = network.journey_fare('PLY', 'BRX')
+   Station('Elsewhere', 'Q', 'XXX', 1., 1., 0).name = 'Y' #editing a station of no network changes nothing
+   other = RailNetwork([Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in [bristol, bath]])
+   other.stations['BTH'].hub = 1 #nor does editing a station of another network
+   assert network.journey_fare('PLY', 'BRX') == before
+   assert network.cache_stats()['invalidations'] == 0
+   stations[3].hub = 1 #Plymouth becomes a hub, so its journey starts at its own hub
+   assert network.journey_fare('PLY', 'BRX') < before
+   assert network.cache_stats()['invalidations'] == 1
+
+def test_direct_station_edits_are_seen():
+   stations = copy_fare_stations()
+   network = RailNetwork(stations)
+   network.fare_matrix()
+   network.compile()
+   assert network.closest_hub(network.stations['BTH']).crs == 'BRI'
+   network.stations['BTH'].hub = 1 #edited directly rather than with set_hub
+   assert [hub.crs for hub in network.hub_stations('South West')] == ['BRI', 'EXD', 'BTH']
+   assert network.closest_hub(network.stations['BTH']).crs == 'BTH'
+   network.decompile()
+   same_as_rebuilt(network)
+   network.compile()
+   rebuilt = RailNetwork([Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in network.stations.values()])
+   assert network.journey_fare('BTH', 'MAN') == rebuilt.journey_fare('BTH', 'MAN')
+   removed = network.stations.pop('PLY')
+   assert type(removed) is Station and type(stations[0]) is not Station #only stations a network holds count edits
+   removed.hub = 1
+   assert network._seen == network._version.count
+   compact = RailNetwork(copy_fare_stations(), compact=True)
+   compact.stations['BTH'].hub = 1 #a compact network makes a new Station on each lookup, so this edit is lost
+   assert [hub.crs for hub in compact.hub_stations('South West')] == ['BRI', 'EXD']
+
+# Tests for parallel fare computation
+
+def test_parallel_fare_matrix_identical():
+   fares, crs = fare_network.fare_matrix()
+   parallel_fares, parallel_crs = fare_network.fare_matrix(workers=2)
+   assert parallel_crs == crs
+   assert np.array_equal(parallel_fares, fares, equal_nan=True)
+
+def test_parallel_journey_fares_identical():
+   pairs = [(start, dest) for start in fare_network.stations for dest in ['PLY', 'LIV', 'BNG']]
+   assert np.array_equal(fare_network.journey_fares(pairs, workers=2), fare_network.journey_fares(pairs), equal_nan=True)
+
+def test_parallel_workers_value():
+   with raises(ValueError, match='workers must be a positive int'):
+      fare_network.fare_matrix(workers=0)
+
+# Tests for the benchmark suite
+
+def test_synthetic_stations():
+   stations = synthetic_stations(500, n_regions=7, hub_fraction=0.1, seed=3)
+   network = RailNetwork(stations) #crs codes must be unique
+   assert len(network.regions()) == 7
+   assert len(network.hub_stations()) == 7 #every region has a hub
+   assert [s.crs for s in synthetic_stations(500, 7, 0.1, seed=3)] == [s.crs for s in stations]
+
+def test_benchmark_run():
+   results = benchmarks.run([50], n_regions=3, min_time=0.001)
+   assert set(results['results']['50']) == {'distance_to', 'fare_price', 'hub_stations', 'closest_hub', 'journey_planner',
+                                            'journey_fare', 'compiled_journey_fare', 'read_rail_network'}
+
+def test_benchmark_compare():
+   baseline = {'results': {'100': {'journey_fare': 1e-5, 'fare_price': 1e-6}}}
+   current = {'results': {'100': {'journey_fare': 2e-5, 'fare_price': 1.1e-6}, '1000': {'journey_fare': 1e-5}}}
+   assert compare_names(benchmarks.compare(baseline, current, threshold=0.2)) == [('100', 'journey_fare')]
+
+def compare_names(slower):
+   return [(size, name) for size, name, before, seconds, ratio in slower]
+
+# Tests for batch fare reports
+
+def test_fare_reports_files(tmp_path):
+   fares, crs = fare_network.fare_matrix()
+   assert fare_network.render_fare_reports(tmp_path, fares=fares, crs=crs, bins=5) == len(crs)
+   assert sorted(path.name for path in tmp_path.iterdir()) == sorted(report_name(fare_network.stations[code].name, code, 'png') for code in crs)
+
+def test_fare_reports_parallel_svg(tmp_path):
+   assert fare_network.render_fare_reports(tmp_path, fmt='svg', workers=2) == fare_network.n_stations
+   assert all(path.suffix == '.svg' for path in tmp_path.iterdir())
+
+def test_fare_reports_bad_input(tmp_path):
+   with raises(ValueError):
+      fare_network.render_fare_reports(tmp_path, fmt='jpg')
+   with raises(ValueError):
+      fare_network.render_fare_reports(tmp_path, fares=np.zeros((2, 2)), crs=['BRI'])
+
+def test_render_journeys(tmp_path):
+   paths = render_journeys(fare_network, [('BRI', 'MAN'), ('EUS', 'BRX')], tmp_path)
+   assert [path.name for path in paths] == ['Journey_BRI_MAN.png', 'Journey_EUS_BRX.png']
+   assert all(path.exists() for path in paths)
+
+def test_fare_reports_leave_pyplot_alone(tmp_path):
+   import matplotlib
+   import matplotlib.pyplot as plt
+   backend, figures = matplotlib.get_backend(), plt.get_fignums()
+   fare_network.render_fare_reports(tmp_path)
+   render_journeys(fare_network, [('BRI', 'MAN')], tmp_path)
+   assert matplotlib.get_backend() == backend and plt.get_fignums() == figures
+
+# Tests for lazy imports
+
+def test_import_railway_skips_plotting():
+   seconds, loaded = benchmarks.import_time('railway', repeat=1)
+   assert seconds > 0
+   assert 'railway' in loaded
+   assert not [module for module in loaded if module.split('.')[0] in ('matplotlib', 'numpy')]
+
+# Tests for route
+
+def route_cost(route, weight):
+   hubs = {region: len(stations) for region, stations in fare_network.hub_stations().items()}
+   cost = 0
+   for a, b in zip(route, route[1:]):
+      distance = a.distance_to(b)
+      cost += distance if weight == 'distance' else fare_price(distance, int(a.region != b.region), hubs[b.region])
+   return cost
+
+def test_route_is_cheapest():
+   hubs = [station for station in fare_network.stations.values() if station.hub]
+   for weight in ('fare', 'distance'):
+      for start, dest in [('PLY', 'PRE'), ('BTH', 'BRX'), ('BRI', 'MAN'), ('PLY', 'BTH'), ('EUS', 'PRE')]:
+         route, cost = fare_network.route(start, dest, weight)
+         assert [route[0].crs, route[-1].crs] == [start, dest]
+         assert cost == approx(route_cost(route, weight))
+         #every route through up to three hubs that keeps to the station to hub links
+         s, d = fare_network.stations[start], fare_network.stations[dest]
+         for n in range(1, 4):
+            for middle in itertools.permutations(hubs, n):
+               path = [s] + [hub for hub in middle if hub.crs not in (start, dest)] + [d]
+               if (s.hub or s.region == path[1].region) and (d.hub or d.region == path[-2].region):
+                  assert cost <= route_cost(path, weight) + 1e-9
+
+def test_route_same_region_and_station():
+   route, cost = fare_network.route('BTH', 'BTH')
+   assert [station.crs for station in route] == ['BTH'] and cost == 0
+   route, cost = fare_network.route('BRX', 'EUS', 'distance')
+   assert [station.crs for station in route] == ['BRX', 'EUS']
+   assert cost == approx(brixton.distance_to(euston))
+
+def test_route_errors():
+   with raises(KeyError):
+      fare_network.route('BNG', 'BRI') #no hub in Wales
+   with raises(ValueError):
+      fare_network.route('BRI', 'MAN', 'time')
+
+# Tests for incremental network updates
+
+def copy_fare_stations():
+   return [Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in fare_network.stations.values()]
+
+def same_as_rebuilt(network):
+   rebuilt = RailNetwork([Station(s.name, s.region, s.crs, s.lat, s.lon, s.hub) for s in network.stations.values()])
+   assert {r: [h.crs for h in hubs] for r, hubs in network.hub_stations().items()} == \
+          {r: [h.crs for h in hubs] for r, hubs in rebuilt.hub_stations().items()}
+   fares, crs = network.fare_matrix()
+   rebuilt_fares, rebuilt_crs = rebuilt.fare_matrix()
+   assert crs == rebuilt_crs and np.array_equal(fares, rebuilt_fares, equal_nan=True)
+   for start in crs:
+      for dest in crs:
+         if 'Wales' not in (network.stations[start].region, network.stations[dest].region):
+            assert network.journey_fare(start, dest) == rebuilt.journey_fare(start, dest)
+
+def test_add_and_remove_station():
+   for compact in (False, True):
+      network = RailNetwork(copy_fare_stations(), compact=compact)
+      network.fare_matrix() #tables built before the change
+      network.add_station(Station('Cardiff Central', 'Wales', 'CDF', 51.475, -3.179, 1))
+      assert network.closest_hub(network.stations['BNG']).crs == 'CDF'
+      same_as_rebuilt(network)
+      network.remove_station('EUS')
+      assert 'EUS' not in network.stations
+      with raises(KeyError):
+         network.hub_stations('London')
+      with raises(KeyError):
+         network.add_station(Station('Bath Spa', 'South West', 'BTH', 51.377538, -2.356996, 0))
+
+def test_set_hub_and_move_station():
+   for compact in (False, True):
+      network = RailNetwork(copy_fare_stations(), compact=compact)
+      network.fare_matrix()
+      network.set_hub('BTH', True)
+      assert network.closest_hub(network.stations['BTH']).crs == 'BTH'
+      network.set_hub('EXD', 0)
+      assert [hub.crs for hub in network.hub_stations('South West')] == ['BRI', 'BTH']
+      network.move_station('PLY', region='Wales')
+      network.move_station('BRX', lat=51.5, lon=-0.2)
+      same_as_rebuilt(network)
+      with raises(ValueError):
+         network.move_station('BRX', lat=91.0)
+
+def test_route_after_move_to_new_region():
+   for compact in (False, True):
+      network = RailNetwork([Station('A', 'R', 'AAA', 51.0, 0.0, 1), Station('B', 'R', 'BBB', 51.1, 0.1, 0),
+                             Station('C', 'R', 'CCC', 51.2, 0.2, 0)], compact)
+      network.route('BBB', 'CCC') #route graph built before the change
+      network.move_station('CCC', region='New')
+      with raises(KeyError):
+         network.route('CCC', 'BBB') #no hub in New
+      network.move_station('BBB', region='New')
+      assert [station.crs for station in network.route('CCC', 'BBB')[0]] == ['CCC', 'BBB']
+
+def test_incremental_update_keeps_other_regions_cached():
+   network = RailNetwork(copy_fare_stations())
+   network.enable_cache()
+   network.journey_fare('MAN', 'EUS')
+   network.journey_fare('BRI', 'BTH')
+   network.set_hub('PLY', 1)
+   assert network.cache_stats()['size'] == 2 #the journey and fare from MAN to EUS, only the South West ones were dropped
+   network.journey_fare('MAN', 'EUS')
+   assert network.cache_stats()['hits'] == 1
+
+# Tests for the quote server
+
+def test_quoter_coalesces_and_batches():
+   async def quotes():
+      quoter = FareQuoter(fare_network, executor_batch=3)
+      fares = await asyncio.gather(*[quoter.fare('BRI', 'MAN') for i in range(5)], quoter.fare('PLY', 'EUS'),
+                                   quoter.fare('BTH', 'PRE'), return_exceptions=True)
+      with raises(KeyError):
+         await quoter.fare('BNG', 'BRI') #no hub in Wales
+      return fares, quoter.metrics()
+   fares, metrics = asyncio.run(quotes())
+   assert fares[:5] == [fares[0]]*5
+   assert [round(fare, 2) for fare in fares[4:]] == [round(fare_network.journey_fare(*pair), 2) for pair in [('BRI', 'MAN'), ('PLY', 'EUS'), ('BTH', 'PRE')]]
+   assert (metrics['quotes'], metrics['coalesced'], metrics['batches'], metrics['executor_batches']) == (8, 4, 2, 1)
+   assert metrics['latency']['fare']['count'] == 8 and metrics['latency']['fare']['p50_ms'] <= metrics['latency']['fare']['p99_ms']
+
+def test_quoter_empty_network_and_held_batches():
+   async def quotes():
+      quoter = FareQuoter(RailNetwork([])) #warming up the tables of an empty network works
+      with raises(KeyError, match='BRI'):
+         await quoter.fare('BRI', 'BTH')
+      quoter = FareQuoter(fare_network, batch_delay=0)
+      pending = asyncio.ensure_future(quoter.fare('BRI', 'MAN'))
+      for i in range(10): #until the batch is started, after which only the quoter holds its task
+         if quoter._tasks:
+            break
+         await asyncio.sleep(0)
+      held = len(quoter._tasks)
+      fare = await pending
+      return held, fare, len(quoter._tasks)
+   assert asyncio.run(quotes()) == (1, fare_network.journey_fare('BRI', 'MAN'), 0)
+
+def test_quote_server_http():
+   async def requests():
+      server = QuoteServer(FareQuoter(fare_network))
+      host, port = await server.start('127.0.0.1', 0)
+      body = json.dumps({'pairs': [['BRI', 'BTH'], ['BNG', 'BRI']]}).encode()
+      replies = []
+      for request in [b'GET /journey?start=PLY&dest=EUS HTTP/1.1\r\n\r\n', b'GET /fare?start=XXX&dest=EUS HTTP/1.1\r\n\r\n',
+                      b'POST /fares HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body,
+                      b'GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n']:
+         reader, writer = await asyncio.open_connection(host, port)
+         writer.write(request)
+         head = await reader.readuntil(b'\r\n\r\n')
+         length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+         replies.append((int(head.split()[1]), json.loads(await reader.readexactly(length))))
+         writer.close()
+      await server.close()
+      return replies
+   journey, unknown, fares, metrics = asyncio.run(requests())
+   assert journey == (200, {'start': 'PLY', 'dest': 'EUS', 'route': ['PLY', 'EXD', 'EUS'], 'fare': approx(fare_network.journey_fare('PLY', 'EUS'))})
+   assert unknown == (404, {'error': 'crs not in network: XXX'})
+   assert fares == (200, {'fares': [approx(fare_network.journey_fare('BRI', 'BTH')), None]})
+   assert metrics[0] == 200 and metrics[1]['quotes'] == 4
+
+def test_quote_server_bad_body_and_errors():
+   server = QuoteServer(FareQuoter(fare_network))
+   for body in (b'[]', b'3', b'"pairs"'):
+      assert asyncio.run(server.respond('POST', '/fares', body)) == (400, {'error': 'body must be a JSON object'})
+   async def broken(pairs):
+      raise RuntimeError('pricing failed')
+   server.quoter.fares = broken
+   assert asyncio.run(server.respond('POST', '/fares', b'{"pairs": [["BRI", "BTH"]]}')) == (500, {'error': 'internal error: RuntimeError'})
+
+# Tests for instrumentation
+
+def test_profile_records_calls_and_restores_methods():
+   original = RailNetwork.closest_hub
+   network = RailNetwork(copy_fare_stations())
+   network.enable_cache()
+   with instrumentation.profile() as profile:
+      assert RailNetwork.closest_hub is not original
+      network.journey_fare('PLY', 'PRE')
+      network.journey_fare('PLY', 'PRE')
+   assert RailNetwork.closest_hub is original and not instrumentation.enabled()
+   stats = profile.stats()
+   assert stats['journey_fare']['calls'] == 2 and stats['journey_fare']['hit_rate'] == 0.5
+   assert stats['_price_journey']['calls'] == 1
+   assert stats['distance_to']['calls'] > 0
+   assert stats['closest_hub']['cache_hits'] > 0 and 0 <= stats['closest_hub']['p50_s'] <= stats['closest_hub']['p99_s']
+
+def test_profile_closest_hub_hits_match_lookups(tmp_path):
+   network = RailNetwork(copy_fare_stations(), compact=True)
+   with instrumentation.profile() as profile:
+      network.closest_hub(network.stations['BTH']) #first lookup measures the hubs
+      network.closest_hub(network.stations['BTH'])
+      network.closest_hub(Station('Bath Spa', 'South West', 'BTH', 51.377, -2.357, False)) #shares a crs, never cached
+   assert profile.stats()['closest_hub']['cache_hits'] == 1
+   network.save_binary(tmp_path/'network.railnet')
+   loaded = RailNetwork.load_binary(tmp_path/'network.railnet')
+   assert loaded.compact and loaded.columns().closest is not None
+   with instrumentation.profile() as profile:
+      loaded.closest_hub(loaded.stations['BTH']) #precomputed, so an array read
+   assert profile.stats()['closest_hub']['cache_hits'] == 1
+
+def test_profile_prometheus_text():
+   with instrumentation.profile() as profile:
+      fare_network.hub_stations('London')
+   text = profile.prometheus()
+   assert '# TYPE railway_call_seconds summary' in text
+   assert 'railway_call_seconds_count{method="hub_stations"} 1' in text
+   assert instrumentation.stats() == {} and instrumentation.prometheus() == ''
+
+# Tests for the distance table
+
+def test_distance_table_fares_same_pence(tmp_path):
+   network = RailNetwork(copy_fare_stations())
+   pairs = [(start, dest) for start in network.stations for dest in network.stations if 'BNG' not in (start, dest)]
+   fares = [network.journey_fare(start, dest) for start, dest in pairs]
+   for options in ({}, {'tiled': True, 'tile': 3}, {'path': tmp_path/'distances.bin', 'tile': 4}):
+      network.enable_distance_table(**options)
+      assert [round(network.journey_fare(start, dest), 2) for start, dest in pairs] == [round(fare, 2) for fare in fares]
+      assert network.distance('BRI', 'MAN') == network.distance('MAN', 'BRI') == approx(bristol.distance_to(manchester), abs=1e-3)
+      assert network.distance('BTH', 'BTH') == 0
+   assert (tmp_path/'distances.bin').exists()
+
+def test_distance_table_storage_and_updates():
+   stations = synthetic_stations(300, 4, 0.1)
+   network = RailNetwork(stations)
+   network.enable_distance_table()
+   assert network.distance_table().nbytes == 300*299//2*4
+   assert network.distance(stations[7].crs, stations[250].crs) == approx(stations[7].distance_to(stations[250]), rel=1e-6)
+   network.move_station(stations[7].crs, lat=50.0)
+   assert network.distance(stations[7].crs, stations[250].crs) == approx(stations[7].distance_to(stations[250]), rel=1e-6)
+   network.disable_distance_table()
+   assert network.distance_table() is None
+
+# Tests for streaming fares
+
+def test_iter_fares_to_and_from():
+   to_man = list(fare_network.iter_fares_to('MAN', chunk_size=3))
+   assert [(origin, dest) for origin, dest, fare in to_man] == [(crs, 'MAN') for crs in fare_network.stations if crs != 'MAN']
+   for origin, dest, fare in to_man:
+      if origin == 'BNG':
+         assert math.isnan(fare)
+      else:
+         assert round(fare, 2) == round(fare_network.journey_fare(origin, dest), 2)
+   from_bri = list(fare_network.iter_fares_from('BRI'))
+   assert [dest for origin, dest, fare in from_bri] == [crs for crs in fare_network.stations if crs != 'BRI']
+   assert from_bri[2][2] == approx(fare_network.journey_fare('BRI', from_bri[2][1]))
+
+def test_iter_all_fares_chunks():
+   fares, crs = fare_network.fare_matrix()
+   chunks = list(fare_network.iter_all_fares(chunk_size=4, chunks=True))
+   assert len(chunks) == 3 and [len(chunk[2]) for chunk in chunks] == [36, 36, 18]
+   origins, dests, values = (np.concatenate(column) for column in zip(*chunks))
+   assert np.array_equal(values, fares[~np.eye(10, dtype=bool)], equal_nan=True)
+   assert list(zip(origins[:2], dests[:2])) == [('BRI', 'EXD'), ('BRI', 'BTH')]
+   with raises(ValueError):
+      list(fare_network.iter_all_fares(chunk_size=0))
+
+def test_export_fares(tmp_path):
+   assert fare_network.export_fares(tmp_path/'fares.csv', chunk_size=3) == 90
+   rows = (tmp_path/'fares.csv').read_text().splitlines()
+   assert rows[0] == 'origin,dest,fare' and len(rows) == 91
+   assert rows[1].startswith('BRI,EXD,') and float(rows[1].split(',')[2]) == approx(fare_network.journey_fare('BRI', 'EXD'))
+   assert any(row.startswith('BNG,') and row.endswith(',') for row in rows)
+   assert fare_network.export_fares(tmp_path/'columns', 'npy', chunk_size=3) == 90
+   fares = np.load(tmp_path/'columns'/'fare.npy', mmap_mode='r')
+   origins = np.load(tmp_path/'columns'/'origin.npy')
+   assert origins[0] == 'BRI' and fares[0] == approx(fare_network.journey_fare('BRI', 'EXD'))
+
+# Tests for region sharding
+
+def test_sharded_network_matches_network():
+   network = RailNetwork(copy_fare_stations())
+   with network.shard() as sharded:
+      assert sorted(sharded.regions()) == sorted(network.regions()) and len(sharded.hubs) == 5
+      for start in network.stations:
+         for dest in network.stations:
+            if 'BNG' in (start, dest):
+               with raises(KeyError):
+                  sharded.journey_fare(start, dest)
+               continue
+            assert [station.crs for station in sharded.journey_planner(start, dest)] == [station.crs for station in network.journey_planner(start, dest)]
+            assert sharded.journey_fare(start, dest) == network.journey_fare(start, dest)
+      with raises(KeyError):
+         sharded.journey_fare('BRI', 'XXX')
+      with raises(ValueError):
+         sharded.journey_planner('BRIS', 'MAN')
+
+def test_sharded_network_processes():
+   stations = synthetic_stations(400, 6, 0.1)
+   network = RailNetwork(stations, compact=True)
+   pairs = [(stations[i].crs, stations[(i*37 + 11) % 400].crs) for i in range(0, 400, 3)]
+   with network.shard(processes=3) as sharded:
+      assert len(sharded.workers) == 3
+      for start, dest in pairs:
+         assert sharded.journey_fare(start, dest) == network.journey_fare(start, dest)
+         assert [station.crs for station in sharded.journey_planner(start, dest)] == [station.crs for station in network.journey_planner(start, dest)]
+   assert sharded.workers == []
+
+# Tests for compiled fares
+
+def test_compiled_fares_identical():
+   network = RailNetwork(copy_fare_stations())
+   fares = {(start, dest): network.journey_fare(start, dest) for start in network.stations for dest in network.stations if 'BNG' not in (start, dest)}
+   compiled = network.compile()
+   assert compiled is network.compiled_fares() and len(compiled) == 10
+   for (start, dest), fare in fares.items():
+      assert network.journey_fare(start, dest) == fare
+      assert compiled.fare_ids(compiled.ids[start], compiled.ids[dest]) == fare
+   assert network.journey_fare('BRI', 'MAN', summary=True) == network.journey_fare('BRI', 'MAN', summary=True)
+   assert math.isnan(compiled.fares([('BNG', 'BRI'), ('BRI', 'EXD')])[0])
+   with raises(KeyError):
+      network.journey_fare('BNG', 'BRI')
+   with raises(KeyError):
+      network.journey_fare('BRI', 'XXX')
+   network.decompile()
+   assert network.compiled_fares() is None
+
+def test_compiled_fares_follow_changes():
+   stations = synthetic_stations(400, 5, 0.05)
+   for compact in (False, True):
+      network = RailNetwork(stations, compact)
+      network.compile()
+      network.set_hub(stations[3].crs, not stations[3].hub)
+      network.move_station(stations[10].crs, region=stations[200].region)
+      pairs = [(stations[i].crs, stations[(i*31 + 7) % 400].crs) for i in range(400)]
+      network.decompile()
+      fares = [network.journey_fare(start, dest) for start, dest in pairs]
+      network.compile()
+      assert [network.journey_fare(start, dest) for start, dest in pairs] == fares
+
+def test_compiled_fares_without_hub_table(monkeypatch):
+   import compiled_fares
+   monkeypatch.setattr(compiled_fares, 'HUB_TABLE_MAX', 1)
+   network = RailNetwork(copy_fare_stations())
+   compiled = network.compile()
+   assert compiled.hub_fares is None
+   assert compiled.fare('BTH', 'PRE') == RailNetwork(copy_fare_stations()).journey_fare('BTH', 'PRE')
+
+# Tests for what-if fares
+
+def what_if_expected(candidate):
+   network = RailNetwork(copy_fare_stations())
+   for crs, changes in candidate.items():
+      network.move_station(crs, region=changes.get('region'))
+      if 'hub' in changes:
+         network.set_hub(crs, changes['hub'])
+   return network.fare_matrix()[0]
+
+def test_what_if_matches_changed_network():
+   fares, crs = fare_network.fare_matrix()
+   candidates = ['PRE', 'BRI', {'BNG': {'hub': True}}, {'BTH': {'region': 'London'}}, {'EUS': {'region': 'Wales'}, 'PRE': {'hub': 1}}]
+   results = fare_network.what_if(candidates)
+   assert results[0]['changes'] == {'PRE': {'hub': True}} and results[1]['changes'] == {'BRI': {'hub': False}}
+   for candidate, result in zip(candidates, results):
+      expected = what_if_expected(result['changes'])
+      changed = ~((fares == expected) | (np.isnan(fares) & np.isnan(expected))) & ~np.eye(10, dtype=bool)
+      stats, deltas = result['stats'], result['deltas']
+      assert stats['pairs_changed'] == changed.sum() == len(deltas['delta'])
+      rows, cols = [crs.index(code) for code in deltas['origin']], [crs.index(code) for code in deltas['dest']]
+      assert np.allclose(deltas['new'], expected[rows, cols], rtol=0, atol=1e-9, equal_nan=True)
+      assert np.array_equal(deltas['old'], fares[rows, cols], equal_nan=True)
+      assert stats['total_delta'] == approx(np.nansum(deltas['delta']))
+   assert results[2]['stats']['now_priced'] == 18 and results[2]['stats']['now_unpriced'] == 0
+   assert fare_network.what_if([{'BNG': {'region': 'London'}}], deltas=False)[0]['deltas'] is None
+   assert fare_network.hub_stations('North West') == [manchester, liverpool] #the network itself is not changed
+
+def test_what_if_parallel_and_errors():
+   candidates = ['PRE', 'BTH', {'MAN': {'hub': False}, 'LIV': {'hub': False}}, {'PLY': {'region': 'Cornwall', 'hub': True}}]
+   assert fare_network.what_if(candidates, workers=2, deltas=False) == fare_network.what_if(candidates, deltas=False)
+   assert fare_network.what_if([]) == []
+   with raises(KeyError):
+      fare_network.what_if(['XXX'])
+   with raises(ValueError):
+      fare_network.what_if([{'PRE': {'lat': 50.0}}])
+   with raises(ValueError):
+      fare_network.what_if(['PRE'], workers=0)
+
+# Tests for fare snapshots
+
+def test_fare_snapshot_round_trip(tmp_path):
+   from fare_snapshot import FareSnapshot
+   assert fare_network.save_fare_snapshot(tmp_path/'v1.snap', 'v1', chunk_rows=3) == 4
+   snapshot = FareSnapshot(tmp_path/'v1.snap')
+   assert snapshot.label == 'v1' and len(snapshot) == 10 and snapshot.verify() == []
+   assert snapshot.fare('BRI', 'MAN') == round(fare_network.journey_fare('BRI', 'MAN'), 2)
+   assert math.isnan(snapshot.fare('BNG', 'BRI'))
+   with open(tmp_path/'v1.snap', 'r+b') as file: #corrupt one fare of the second chunk
+      file.seek(snapshot.header['sections']['fares'][0] + 4*10*4)
+      file.write(b'\x01\x02\x03\x04')
+   assert FareSnapshot(tmp_path/'v1.snap').verify() == [1]
+   (tmp_path/'other.bin').write_bytes(b'not a snapshot at all')
+   with raises(ValueError):
+      FareSnapshot(tmp_path/'other.bin')
+
+def test_fare_snapshot_diff(tmp_path):
+   from fare_snapshot import FareSnapshot, diff
+   fare_network.save_fare_snapshot(tmp_path/'v1.snap', 'v1', chunk_rows=3)
+   network = RailNetwork(copy_fare_stations())
+   network.set_hub('PRE', 1)
+   network.move_station('BTH', lat=51.5)
+   network.remove_station('BRX')
+   network.add_station(Station('Cardiff Central', 'Wales', 'CDF', 51.475, -3.179, 1))
+   network.save_fare_snapshot(tmp_path/'v2.snap', 'v2', chunk_rows=3)
+   changes = diff(FareSnapshot(tmp_path/'v1.snap'), FareSnapshot(tmp_path/'v2.snap'))
+   assert changes['added'] == ['CDF'] and changes['removed'] == ['BRX']
+   assert set(changes['changed']) == {'BTH', 'MAN', 'LIV', 'PRE', 'BNG'}
+   fares = changes['fares']
+   def pence(network, start, dest):
+      try:
+         return round(network.journey_fare(start, dest)*100)
+      except KeyError: #Wales had no hub before Cardiff
+         return None
+   expected = {(start, dest) for start in fare_network.stations for dest in fare_network.stations if 'BRX' not in (start, dest)
+               and pence(network, start, dest) != pence(fare_network, start, dest)}
+   assert set(zip(fares['origin'].tolist(), fares['dest'].tolist())) == expected
+   assert changes['pairs_compared'] < 81
+   from_network = network.diff_fare_snapshot(tmp_path/'v1.snap')
+   assert from_network['changed'] == changes['changed'] and np.array_equal(from_network['fares']['new'], fares['new'], equal_nan=True)
+   unchanged = diff(FareSnapshot(tmp_path/'v1.snap'), FareSnapshot(tmp_path/'v1.snap'))
+   assert unchanged['chunks_skipped'] == 4 and unchanged['pairs_compared'] == 0 and len(unchanged['fares']['old']) == 0
+
+def test_fare_snapshot_cli(tmp_path, capsys):
+   from fare_snapshot import main
+   path = write_csv(tmp_path / 'stations.csv', network_rows)
+   assert main(['save', str(path), str(tmp_path/'v1.snap'), '--label', 'v1']) == 0
+   write_csv(path, network_rows + ['Clapham Junction,London,CLJ,51.464188,-0.170293,1'])
+   assert main(['save', str(path), str(tmp_path/'v2.snap'), '--chunk-rows', '2']) == 0
+   capsys.readouterr()
+   assert main(['load', str(tmp_path/'v1.snap')]) == 0
+   assert json.loads(capsys.readouterr().out) == {'label': 'v1', 'stations': 5, 'chunks': 1, 'corrupted': []}
+   assert main(['diff', str(tmp_path/'v1.snap'), str(tmp_path/'v2.snap'), '--csv', str(tmp_path/'changes.csv')]) == 0
+   summary = json.loads(capsys.readouterr().out)
+   assert summary['added'] == ['CLJ'] and sorted(summary['changed']) == ['BRX', 'EUS'] and summary['fares_changed'] > 0
+   assert (tmp_path/'changes.csv').read_text().startswith('origin,dest,old,new')
@@ -0,0 +1,221 @@
+'''
+What-if fares for candidate changes to a network: flipping stations to or from hubs and moving stations to another region.
+
+A fare only depends on per-station values of its two ends (region, closest hub, hubs in region and the legs to and from the
+closest hub), so a candidate is evaluated by working out those values again for the regions it touches, finding the stations
+where any of them changed, and repricing only the pairs that start or end at one of those stations. The hub count of a region
+only prices the legs into it, so a station that only has a new hub count keeps its fares from anywhere. Pairs are priced in
+blocks with the FareTables of the network, so fares agree with journey_fare to the penny, and many candidates can be evaluated
+in a process pool that shares the tables of the network.
+
+A candidate is a crs, which flips that station's hub flag, or a dict of crs to the changes for that station, e.g.
+{'PRE': {'hub': True}, 'BNG': {'region': 'North West'}}. A station's fare to itself is left out.
+'''
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from fare_engine import FareTables, closest_hub_rows, haversine, BLOCK_ROWS
+from parallel_fares import share_arrays, view_arrays
+
+FIELDS = ('hub', 'region') #changes a candidate can make to a station
+START_ARRAYS = ('region', 'closest', 'has_hub') #a station whose values of these change has new fares from it
+DEST_ARRAYS = START_ARRAYS + ('hubs_in_region',) #and of these new fares to it, the hub count only prices legs into its region
+
+HUB_TABLE_MAX = 4096 #most hubs the middle leg distances are tabled for, H*H*8 bytes (128 MB at 4096)
+
+_worker = {} #state of a pool worker: its shared memory and the tables viewing it
+
+
+class HubLegTables(FareTables):
+    '''
+    FareTables that look the middle leg distances up in a table between every station that is or could become a hub,
+    hub_slot gives the row and column of each station in hub_distances (-1 for the others)
+    '''
+    @classmethod
+    def around(cls, tables, hub_slot, hub_distances):
+        tables = cls.from_arrays(tables.arrays())
+        tables.hub_slot, tables.hub_distances = hub_slot, hub_distances
+        return tables
+
+    def hub_distance(self, start_hubs, end_hubs):
+        return self.hub_distances[self.hub_slot[start_hubs], self.hub_slot[end_hubs]]
+
+
+def hub_table(tables, hubs):
+    '''
+    Function works out the distance between every pair of hubs (rows), returns hub_slot and hub_distances for HubLegTables
+    '''
+    hub_slot = np.full(len(tables), -1, dtype=np.intp)
+    hub_slot[hubs] = np.arange(len(hubs))
+    lat, lon = tables.lat[hubs], tables.lon[hubs]
+    return hub_slot, haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+
+def resolve(columns, candidate):
+    '''
+    Function turns a candidate into station rows with their new hub flags and region ids, region names not in the network
+    are given new ids after the existing ones. Returns (rows, hubs, regions, the changes as a dict of crs to changes).
+    '''
+    if isinstance(candidate, str):
+        candidate = {candidate: {'hub': not columns.hub[columns.index[candidate]]}}
+    if not isinstance(candidate, dict): raise(TypeError('candidate must be a crs or a dict of crs to changes'))
+    region_names = list(columns.region_names)
+    rows, hubs, regions = [], [], []
+    for crs, changes in candidate.items():
+        if not isinstance(changes, dict) or not set(changes) <= set(FIELDS): raise(ValueError(f'changes must be a dict of {", ".join(FIELDS)}'))
+        row = columns.index[crs]
+        hub = changes.get('hub', columns.hub[row])
+        if int(hub) not in (0, 1) or float(hub) != int(hub): raise(ValueError('hub must be a bool or 0/1'))
+        region = changes.get('region', region_names[columns.region[row]])
+        if not isinstance(region, str): raise(TypeError('region must be a str'))
+        if region not in region_names:
+            region_names.append(region)
+        rows.append(row)
+        hubs.append(bool(hub))
+        regions.append(region_names.index(region))
+    return np.array(rows, dtype=np.intp), np.array(hubs, dtype=bool), np.array(regions, dtype=np.intp), candidate
+
+
+def scenario_tables(tables, hub, rows, hubs, regions):
+    '''
+    Function makes the FareTables of the network with the stations at rows given new hub flags and region ids.
+    Only the stations of the regions they leave or join are worked out again. Returns the tables and those stations.
+    '''
+    arrays = {name: array.copy() for name, array in tables.arrays().items()}
+    region, hub = arrays['region'], hub.copy()
+    touched = np.union1d(region[rows], regions)
+    region[rows] = regions
+    hub[rows] = hubs
+
+    hub_counts = np.bincount(region[hub], minlength=max(len(tables.hub_counts), int(region.max()) + 1 if len(region) else 0))
+    arrays.update(hub_counts=hub_counts, hubs_in_region=hub_counts[region], has_hub=hub_counts[region] > 0)
+    scenario = copy.copy(tables) #same kind of tables, with the copied arrays
+    for name, array in arrays.items():
+        setattr(scenario, name, array)
+    members = np.flatnonzero(np.isin(region, touched))
+    scenario.closest[members] = closest_hub_rows(scenario.lat, scenario.lon, region, hub, regions=touched)[members]
+    scenario._legs(members)
+    return scenario, members
+
+
+def changed_stations(tables, scenario, members, names):
+    '''
+    Function finds the stations among members whose values of the named tables changed
+    '''
+    changed = np.zeros(len(members), dtype=bool)
+    for name in names:
+        changed |= getattr(tables, name)[members] != getattr(scenario, name)[members]
+    return members[changed]
+
+
+def pair_blocks(n:int, starts, dests, block_rows:int=BLOCK_ROWS):
+    '''
+    Function yields (start rows, dest rows) blocks covering every pair that starts at one of starts or ends at one of dests,
+    each pair once
+    '''
+    everyone = np.arange(n)
+    for first in range(0, len(starts), block_rows):
+        yield starts[first:first + block_rows, None], everyone[None, :]
+    others = np.setdiff1d(everyone, starts)
+    for first in range(0, len(others), block_rows):
+        yield others[first:first + block_rows, None], dests[None, :]
+
+
+def evaluate(tables, hub, rows, hubs, regions, deltas:bool=True):
+    '''
+    Function works out the fares a candidate (see resolve) changes. Returns the summary statistics and, with deltas True,
+    the start rows, dest rows, old and new fares of every pair whose fare changed (nan where a region has no hub).
+    '''
+    scenario, members = scenario_tables(tables, hub, rows, hubs, regions)
+    starts = changed_stations(tables, scenario, members, START_ARRAYS)
+    dests = changed_stations(tables, scenario, members, DEST_ARRAYS)
+    stats = {'stations_changed': len(dests), 'pairs_repriced': 0, 'pairs_changed': 0, 'increases': 0, 'decreases': 0,
+             'now_priced': 0, 'now_unpriced': 0, 'total_delta': 0., 'max_increase': 0., 'max_decrease': 0.}
+    found = {'start': [], 'dest': [], 'old': [], 'new': []}
+    for start, dest in pair_blocks(len(tables), starts, dests):
+        start, dest = np.broadcast_arrays(start, dest)
+        keep = start != dest
+        start, dest = start[keep], dest[keep]
+        old, new = tables.fares(start, dest), scenario.fares(start, dest)
+        differs = ~((old == new) | (np.isnan(old) & np.isnan(new)))
+        stats['pairs_repriced'] += len(old)
+        stats['pairs_changed'] += int(differs.sum())
+        stats['now_priced'] += int((np.isnan(old) & ~np.isnan(new)).sum())
+        stats['now_unpriced'] += int((~np.isnan(old) & np.isnan(new)).sum())
+        delta = (new - old)[differs]
+        delta = delta[~np.isnan(delta)]
+        if len(delta):
+            stats['increases'] += int((delta > 0).sum())
+            stats['decreases'] += int((delta < 0).sum())
+            stats['total_delta'] += float(delta.sum())
+            stats['max_increase'] = max(stats['max_increase'], float(delta.max()))
+            stats['max_decrease'] = min(stats['max_decrease'], float(delta.min()))
+        if deltas:
+            for name, values in zip(found, (start, dest, old, new)):
+                found[name].append(values[differs])
+
+    priced = stats['increases'] + stats['decreases']
+    stats['mean_delta'] = stats['total_delta']/priced if priced else 0. #over the pairs priced before and after that changed
+    if not deltas:
+        return stats, None
+    return stats, {name: np.concatenate(values) if values else np.empty(0, dtype=np.float64 if name in ('old', 'new') else np.intp)
+                   for name, values in found.items()}
+
+
+def _attach(name:str, layout:dict):
+    '''
+    Function runs once in each pool worker, viewing the shared tables of the network
+    '''
+    memory = SharedMemory(name)
+    views = view_arrays(memory, layout)
+    _worker['memory'] = memory #kept so the views stay valid
+    _worker['hub'] = views.pop('hub')
+    if 'hub_slot' in views:
+        _worker['tables'] = HubLegTables.around(FareTables.from_arrays(views), views['hub_slot'], views['hub_distances'])
+    else:
+        _worker['tables'] = FareTables.from_arrays(views)
+
+
+def _evaluate_shared(rows, hubs, regions, deltas:bool):
+    return evaluate(_worker['tables'], _worker['hub'], rows, hubs, regions, deltas)
+
+
+def what_if(tables, candidates, workers:int=1, deltas:bool=True):
+    '''
+    Function evaluates candidates (see the module docstring) against the network of a FareTables, see RailNetwork.what_if
+    '''
+    columns = tables.columns
+    hub = np.asarray(columns.hub, dtype=bool)
+    resolved = [resolve(columns, candidate) for candidate in candidates] #bad candidates fail before any work is done
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int) or workers < 1: raise(ValueError('workers must be a positive int or None'))
+
+    shared = {**tables.arrays(), 'hub': hub}
+    hub_rows = np.union1d(np.flatnonzero(hub), np.concatenate([rows for rows, *others in resolved] or [np.empty(0, dtype=np.intp)]))
+    if len(hub_rows) <= HUB_TABLE_MAX: #any hub of a candidate is in the table
+        shared['hub_slot'], shared['hub_distances'] = hub_table(tables, hub_rows)
+        tables = HubLegTables.around(tables, shared['hub_slot'], shared['hub_distances'])
+
+    if workers == 1 or len(resolved) < 2:
+        outcomes = [evaluate(tables, hub, rows, hubs, regions, deltas) for rows, hubs, regions, changes in resolved]
+    else:
+        memory, layout = share_arrays(shared)
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(memory.name, layout)) as pool:
+                outcomes = list(pool.map(_evaluate_shared, *zip(*((rows, hubs, regions, deltas) for rows, hubs, regions, changes in resolved)),
+                                         chunksize=max(len(resolved)//(workers*4), 1)))
+        finally:
+            memory.close()
+            memory.unlink()
+
+    crs = np.array(columns.crs)
+    results = []
+    for (rows, hubs, regions, changes), (stats, found) in zip(resolved, outcomes):
+        if found is not None:
+            found = {'origin': crs[found['start']], 'dest': crs[found['dest']], 'old': found['old'], 'new': found['new'],
+                     'delta': found['new'] - found['old']}
+        results.append({'changes': changes, 'stats': stats, 'deltas': found})
+    return results